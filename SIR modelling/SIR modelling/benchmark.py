@@ -0,0 +1,329 @@
+'''
+Compare the Cell and the NumPy engine of EpiDyn.
+
+    python benchmark.py                      # ticks/sec on a few grid sizes
+    python benchmark.py --compare --runs 20  # mean epidemic curves of both engines
+                                             # (and of the mean-field solution with --spatial 0)
+    python benchmark.py --switch             # latency of quarantine group switch ticks
+    python benchmark.py --profile            # time per phase of EpiDyn.step
+    python benchmark.py --batch 100          # 100 replicates one by one and as one ReplicateBatch
+    python benchmark.py --suite --json results.json [--baseline old.json]
+                                             # full benchmark suite, see run_suite()
+'''
+import argparse
+import itertools
+import json
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+
+import numpy as np
+
+from epidemic.meanfield import meanfield_curves
+from epidemic.model import EpiDyn
+from epidemic.replicates import ReplicateBatch
+
+
+def ticks_per_second(engine, size, ticks, **params):
+    '''
+    Build a size x size model with the given engine and time `ticks` steps.
+    '''
+    model = EpiDyn(height=size, width=size, engine=engine, **params)
+    start = time.perf_counter()
+    for _ in range(ticks):
+        model.step()
+    return ticks / (time.perf_counter() - start)
+
+
+def switch_latency(engine, size, **params):
+    '''
+    Time a tick on which the quarantine groups are formed and the tick after.
+    '''
+    params.update(quarantine_delay=0, groupswitch=True, switchperx=2)
+    model = EpiDyn(height=size, width=size, engine=engine, **params)
+    start = time.perf_counter()
+    model.step()
+    switch = time.perf_counter() - start
+    start = time.perf_counter()
+    model.step()
+    return switch, time.perf_counter() - start
+
+
+def phase_profile(engine, size, ticks, **params):
+    '''
+    Run `ticks` steps with the profiler on and return its summary.
+    '''
+    model = EpiDyn(height=size, width=size, engine=engine, profile=True, **params)
+    for _ in range(ticks):
+        model.step()
+    model.close()
+    return model.profiler.summary()
+
+
+def replicate_time(engine, size, ticks, replicates, **params):
+    '''
+    Time `replicates` runs of `ticks` steps, one model after the other with
+    the given engine or, with engine None, all at once as a ReplicateBatch.
+    '''
+    start = time.perf_counter()
+    if engine is None:
+        ReplicateBatch(replicates, height=size, width=size, seeds=list(range(replicates)), **params).run(ticks)
+    else:
+        for seed in range(replicates):
+            model = EpiDyn(height=size, width=size, engine=engine, seed=seed, **params)
+            for _ in range(ticks):
+                model.step()
+    return time.perf_counter() - start
+
+
+def mean_curves(engine, size, ticks, runs, **params):
+    '''
+    Average the Infectious/Removed/Exposed series over independent runs.
+    '''
+    curves = []
+    for _ in range(runs):
+        model = EpiDyn(height=size, width=size, engine=engine, **params)
+        for _ in range(ticks):
+            model.step()
+        curves.append(model.datacollector.get_model_vars_dataframe().values)
+    return np.mean(curves, axis=0)
+
+
+def is_switch_tick(counter, params):
+    '''
+    Whether EpiDyn forms new quarantine groups on the tick with this counter.
+    '''
+    delay = params["quarantine_delay"]
+    if counter < delay:
+        return False
+    if not params["groupswitch"] and counter != delay:
+        return False
+    return (counter - delay) % params["switchperx"] == 0
+
+
+def peak_rss():
+    '''
+    Peak resident set size of this process in bytes, or None where the
+    resource module is missing (Windows).
+    '''
+    try:
+        import resource
+    except ImportError:
+        return None
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform != "darwin":
+        rss *= 1024
+    return rss
+
+
+def benchmark_case(case, ticks, repeats=5):
+    '''
+    Measure one configuration; runs in a fresh process so that the peak RSS
+    belongs to this case alone.
+    :return: dict of measurements
+    '''
+    params = dict(case)
+    params["height"] = params["width"] = params.pop("size")
+
+    start = time.perf_counter()
+    model = EpiDyn(**params)
+    construct = time.perf_counter() - start
+
+    steady, switch = [], []
+    for _ in range(ticks):
+        counter = model.counter
+        start = time.perf_counter()
+        model.step()
+        elapsed = time.perf_counter() - start
+        (switch if is_switch_tick(counter, params) else steady).append(elapsed)
+
+    # Data collection on its own (step() above includes one collect per tick)
+    start = time.perf_counter()
+    for _ in range(repeats):
+        model.datacollector.collect(model)
+    collect = (time.perf_counter() - start) / repeats
+
+    # Memory allocated while stepping, traced separately as tracing is slow
+    tracemalloc.start()
+    allocated = []
+    for _ in range(min(ticks, repeats)):
+        current = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+        model.step()
+        allocated.append(tracemalloc.get_traced_memory()[1] - current)
+    tracemalloc.stop()
+
+    return {"construct_s": construct,
+            "ticks_per_s": len(steady) / sum(steady) if steady else None,
+            "switch_tick_s": sum(switch) / len(switch) if switch else None,
+            "collect_s": collect,
+            "alloc_bytes_per_tick": int(np.mean(allocated)),
+            "peak_rss_bytes": peak_rss()}
+
+
+def suite_cases(sizes, engines, schedule_types, spatial, max_cell_cells, **params):
+    '''
+    All benchmark configurations; the NumPy engine has no Random scheduling
+    and the Cell engine is skipped above max_cell_cells cells.
+    '''
+    cases = []
+    for size, engine, schedule_type, is_spatial in itertools.product(sizes, engines, schedule_types, spatial):
+        if EpiDyn.engine_types[engine] is not None and schedule_type != "Simultaneous":
+            continue
+        case = dict(params, size=size, engine=engine, schedule_type=schedule_type, spatial=is_spatial)
+        case["skipped"] = engine == "Cell" and size * size > max_cell_cells
+        cases.append(case)
+    return cases
+
+
+def run_suite(cases, ticks):
+    '''
+    Run every case in its own process.
+    :return: list of result dicts (the case plus its measurements)
+    '''
+    results = []
+    for case in cases:
+        result = dict(case)
+        if not case["skipped"]:
+            params = {name: value for name, value in case.items() if name != "skipped"}
+            with ProcessPoolExecutor(max_workers=1, mp_context=get_context("spawn")) as pool:
+                result.update(pool.submit(benchmark_case, params, ticks).result())
+        results.append(result)
+        print(format_result(result), flush=True)
+    return results
+
+
+def format_result(result):
+    '''
+    One line summary of a suite result.
+    '''
+    name = "%5d %-5s %-12s spatial=%d" % (result["size"], result["engine"], result["schedule_type"], result["spatial"])
+    if result["skipped"]:
+        return name + "  skipped"
+    return name + "  build %.3fs  %8.2f ticks/s  switch %s  collect %.1fus  %.1f MB/tick  peak RSS %s" % (
+        result["construct_s"], result["ticks_per_s"] or 0,
+        "%.3fs" % result["switch_tick_s"] if result["switch_tick_s"] is not None else "-",
+        result["collect_s"] * 1e6, result["alloc_bytes_per_tick"] / 2**20,
+        "%.0f MB" % (result["peak_rss_bytes"] / 2**20) if result["peak_rss_bytes"] is not None else "-")
+
+
+def case_key(result):
+    return (result["size"], result["engine"], result["schedule_type"], result["spatial"])
+
+
+def compare_to_baseline(results, baseline, tolerance):
+    '''
+    Report cases whose steady ticks/sec dropped more than `tolerance`
+    (a fraction) below the baseline.
+    :return: number of regressions
+    '''
+    old = {case_key(result): result for result in baseline["results"]}
+    regressions = 0
+    for result in results:
+        before = old.get(case_key(result))
+        if result["skipped"] or before is None or before["skipped"] or not before["ticks_per_s"]:
+            continue
+        change = result["ticks_per_s"] / before["ticks_per_s"] - 1
+        if change < -tolerance:
+            regressions += 1
+            print("REGRESSION %s: %.2f -> %.2f ticks/s (%+.0f%%)" % (
+                case_key(result), before["ticks_per_s"], result["ticks_per_s"], 100 * change))
+    return regressions
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[50, 100, 200])
+    parser.add_argument("--ticks", type=int, default=20)
+    parser.add_argument("--spatial", type=int, default=1)
+    parser.add_argument("--quarantine-delay", type=int, default=7)
+    parser.add_argument("--compare", action="store_true", help="compare mean curves instead of speed")
+    parser.add_argument("--switch", action="store_true", help="time group switch ticks instead of speed")
+    parser.add_argument("--profile", action="store_true", help="time the phases of a tick instead of speed")
+    parser.add_argument("--engines", nargs="+", default=["Cell", "NumPy"], choices=list(EpiDyn.engine_types))
+    parser.add_argument("--suite", action="store_true", help="run the benchmark suite")
+    parser.add_argument("--json", help="file to save the suite results to")
+    parser.add_argument("--baseline", help="suite results to check for regressions against")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed ticks/sec drop against the baseline")
+    parser.add_argument("--max-cell-cells", type=int, default=500 * 500, help="largest grid the Cell engine is run on")
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--frontier", action="store_true", help="only step the frontier with the Cell engine")
+    parser.add_argument("--batch", type=int, metavar="REPLICATES", help="time replicates in a loop and as one batch")
+    args = parser.parse_args()
+    params = dict(spatial=args.spatial, quarantine_delay=args.quarantine_delay,
+                  p_infect=0.25, p_death=0.07, groupsize=4, switchperx=2)
+
+    if args.compare:
+        size = args.sizes[0]
+        cell = mean_curves("Cell", size, args.ticks, args.runs, **params)
+        numpy = mean_curves("NumPy", size, args.ticks, args.runs, **params)
+        print("tick  Infectious(Cell/NumPy)  Removed(Cell/NumPy)")
+        for t in range(0, args.ticks + 1, max(1, args.ticks // 10)):
+            print("%4d  %.4f / %.4f         %.4f / %.4f" % (t, cell[t, 0], numpy[t, 0], cell[t, 1], numpy[t, 1]))
+        if not args.spatial:
+            meanfield = meanfield_curves(params["p_infect"], params["p_death"], params["groupsize"], cell[0, 0], args.ticks)
+            print("mean field Infectious: " + " ".join("%.4f" % i for i in meanfield["Infectious"][::max(1, args.ticks // 10)]))
+        return
+
+    if args.suite:
+        sizes = args.sizes if args.sizes != parser.get_default("sizes") else [100, 200, 500, 1000, 2000]
+        cases = suite_cases(sizes, args.engines, list(EpiDyn.schedule_types), [1, 0], args.max_cell_cells,
+                            quarantine_delay=args.quarantine_delay, p_infect=0.25, p_death=0.07,
+                            groupsize=4, groupswitch=True, switchperx=2, seed=0)
+        results = run_suite(cases, args.ticks)
+        if args.json:
+            with open(args.json, "w") as f:
+                json.dump({"revision": git_revision(), "python": platform.python_version(),
+                           "numpy": np.__version__, "ticks": args.ticks, "results": results}, f, indent=1)
+        if args.baseline:
+            with open(args.baseline) as f:
+                if compare_to_baseline(results, json.load(f), args.tolerance):
+                    sys.exit(1)
+        return
+
+    if args.switch:
+        print("size   engine   switch tick (s)   next tick (s)")
+        for size in args.sizes:
+            for engine in args.engines:
+                switch, tick = switch_latency(engine, size, **params)
+                print("%4d   %-6s   %15.4f   %13.4f" % (size, engine, switch, tick))
+        return
+
+    if args.profile:
+        print("size   engine   phase        mean (s)   share")
+        for size in args.sizes:
+            for engine in args.engines:
+                for phase, timing in phase_profile(engine, size, args.ticks, **params).items():
+                    print("%4d   %-6s   %-10s   %8.5f   %5.1f%%" % (size, engine, phase, timing["mean_s"], 100 * timing["share"]))
+        return
+
+    if args.batch:
+        print("size   " + "   ".join("%s loop (s)" % engine for engine in args.engines) + "   batch (s)")
+        for size in args.sizes:
+            loops = [replicate_time(engine, size, args.ticks, args.batch, **params) for engine in args.engines]
+            batch = replicate_time(None, size, args.ticks, args.batch, **params)
+            print("%4d   " % size + "   ".join("%*.2f" % (len(engine) + 9, loop) for engine, loop in zip(args.engines, loops))
+                  + "   %9.2f" % batch)
+        return
+
+    print("size   Cell ticks/s   NumPy ticks/s")
+    for size in args.sizes:
+        cell = ticks_per_second("Cell", size, args.ticks, frontier=args.frontier, **params)
+        numpy = ticks_per_second("NumPy", size, args.ticks, **params)
+        print("%4d   %12.2f   %13.2f" % (size, cell, numpy))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+// Draws the state grid sent by StateGrid (stategrid.py): either all states
+// as a packed uint8 buffer, or only the cells that changed since the last
+// frame. Every cell is one pixel of an offscreen canvas, which is scaled up
+// onto the visible one.
+var StateGridModule = function(canvas_width, canvas_height, grid_width, grid_height, colors) {
+	var canvas = $(`<canvas width="${canvas_width}" height="${canvas_height}" class="world-grid"/>`)[0];
+	var parent = $('<div style="height:' + canvas_height + 'px;" class="world-grid-parent"></div>')[0];
+	$("#elements").append(parent);
+	parent.append(canvas);
+	var context = canvas.getContext("2d");
+	context.imageSmoothingEnabled = false;
+
+	var pixels = document.createElement("canvas");
+	pixels.width = grid_width;
+	pixels.height = grid_height;
+	var pixelContext = pixels.getContext("2d");
+	var image = pixelContext.createImageData(grid_width, grid_height);
+
+	// RGBA of every state, by letting the browser parse the COLORS names
+	var palette = colors.map(function(color) {
+		pixelContext.fillStyle = color;
+		pixelContext.fillRect(0, 0, 1, 1);
+		return pixelContext.getImageData(0, 0, 1, 1).data.slice(0, 4);
+	});
+
+	// Cell (x, y) has id x * grid_height + y; y = 0 is drawn at the bottom
+	var pixelOf = new Int32Array(grid_width * grid_height);
+	for (var x = 0; x < grid_width; x++)
+		for (var y = 0; y < grid_height; y++)
+			pixelOf[x * grid_height + y] = ((grid_height - y - 1) * grid_width + x) * 4;
+
+	var decode = function(text) {
+		var bytes = atob(text);
+		var buffer = new Uint8Array(bytes.length);
+		for (var i = 0; i < bytes.length; i++)
+			buffer[i] = bytes.charCodeAt(i);
+		return buffer;
+	};
+
+	var paint = function(cell, state) {
+		var pixel = pixelOf[cell];
+		var color = palette[state];
+		image.data[pixel] = color[0];
+		image.data[pixel + 1] = color[1];
+		image.data[pixel + 2] = color[2];
+		image.data[pixel + 3] = color[3];
+	};
+
+	this.render = function(data) {
+		var states = decode(data.states);
+		if (data.full) {
+			for (var cell = 0; cell < states.length; cell++)
+				paint(cell, states[cell]);
+		} else {
+			var cells = new Uint32Array(decode(data.cells).buffer);
+			for (var i = 0; i < cells.length; i++)
+				paint(cells[i], states[i]);
+		}
+		pixelContext.putImageData(image, 0, 0);
+		context.drawImage(pixels, 0, 0, canvas_width, canvas_height);
+	};
+
+	this.reset = function() {
+		image = pixelContext.createImageData(grid_width, grid_height);
+		context.clearRect(0, 0, canvas_width, canvas_height);
+	};
+};
@@ -0,0 +1,277 @@
+'''
+Headless parameter sweeps of EpiDyn over a pool of worker processes.
+
+Every combination of the given parameter values is run once per seed; the
+time series of each run is written to <out>/run_<id>.csv as soon as the run
+finishes, and <out>/runs.csv lists the parameters and seed of every run.
+With --snapshots the per-tick states are also written to <out>/run_<id>/
+in the format of storage.py.
+With --checkpoint every run continues from a checkpoint (see checkpoint.py)
+instead of starting from tick 0, e.g. to try quarantine policies after a
+shared warm-up; the swept parameters and the seed apply from there on.
+With --cache runs that were done before (same parameters, seed, number of
+ticks and model version) are read from that cache, see cache.py.
+With --tolerance only the statistics of every combination are kept (see
+ensemble.py): runs stop once no INFECTIOUS cells are left, and replicates
+are added to a combination until the confidence intervals of its mean
+curves and peak are within +/- tolerance, or --replicates runs were done.
+<out>/ensembles.csv lists the combinations, <out>/ensemble_<id>.csv has
+the mean, variance and quantiles of every tick.
+
+    python sweep.py --p_infect 0.1 0.25 --groupsize 2 4 --replicates 10 --steps 100
+    python sweep.py --checkpoint day25.npz --groupsize 2 4 6 --replicates 10 --steps 50
+    python sweep.py --p_infect 0.1 0.25 --replicates 500 --tolerance 0.005 --steps 200
+'''
+import argparse
+import csv
+import itertools
+import os
+import shutil
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, as_completed, wait
+
+import numpy as np
+import pandas as pd
+
+from .cache import ResultCache
+from .checkpoint import load_checkpoint
+from .ensemble import Ensemble
+from .model import EpiDyn
+
+# The EpiDyn parameters that can be swept, with their command line type
+PARAMETERS = {"height": int,
+              "width": int,
+              "p_infect": float,
+              "p_death": float,
+              "groupsize": int,
+              "quarantine_delay": int,
+              "switchperx": int,
+              "groupswitch": int,
+              "spatial": int,
+              "startblock": int,
+              "density": float,
+              "schedule_type": str,
+              "engine": str,
+              "frontier": int}
+
+
+def parameter_grid(values):
+    '''
+    All combinations of the given parameter values.
+    :param values: dict of parameter name -> list of values
+    :return: list of parameter dicts
+    '''
+    names = sorted(values)
+    return [dict(zip(names, combination)) for combination in itertools.product(*(values[name] for name in names))]
+
+
+# The model of this worker process, reused for the next run with reset()
+worker_model = None
+
+
+def run_one(run_id, params, seed, steps, output=None, checkpoint=None, cache=None):
+    '''
+    Run a single model for `steps` ticks, without any visualization.
+    :param output: directory for the per-tick states (none are kept when None)
+    :param checkpoint: checkpoint file to continue from, instead of tick 0
+    :param cache: ResultCache to take the run from, or to add it to
+    :return: run_id and the collected DataFrame
+    '''
+    global worker_model
+    if cache is not None and checkpoint is None:
+        run = cache.get(params, seed, steps, snapshots=output is not None)
+        if run is None:
+            if worker_model is None:
+                worker_model = EpiDyn(**params)
+            run = cache.run(params, seed, steps, snapshots=output is not None, model=worker_model)
+        if output is not None:
+            shutil.copytree(run.path, output, dirs_exist_ok=True)
+        return run_id, pd.DataFrame(run.summary(), columns=run.columns)
+    if checkpoint is not None:
+        worker_model = load_checkpoint(checkpoint, seed=seed, output=output, **params)
+    elif worker_model is None:
+        worker_model = EpiDyn(seed=seed, output=output, **params)
+    else:
+        worker_model.reset(seed=seed, output=output, **params)
+    for _ in range(steps):
+        worker_model.step()
+    worker_model.close()
+    return run_id, worker_model.datacollector.get_model_vars_dataframe()
+
+
+def run_sweep(values, seeds, steps, out, workers=None, snapshots=False, checkpoint=None, cache=None):
+    '''
+    Run every parameter combination once per seed on a process pool and
+    write each run to `out` as soon as it finishes.
+    :param values: dict of parameter name -> list of values
+    :param seeds: the seeds every combination is run with; every seed gives a
+                  run its own SeedSequence, so runs share no random numbers
+    :param workers: number of worker processes (default: all cores)
+    :param snapshots: also write the states of every tick of every run
+    :param checkpoint: checkpoint file every run continues from
+    :param cache: ResultCache shared by all workers
+    :return: number of runs
+    '''
+    os.makedirs(out, exist_ok=True)
+    runs = [(params, seed) for params in parameter_grid(values) for seed in seeds]
+    names = sorted(values)
+    with open(os.path.join(out, "runs.csv"), "w", newline="") as index:
+        writer = csv.writer(index)
+        writer.writerow(["run_id"] + names + ["seed", "file"])
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = [pool.submit(run_one, run_id, params, seed, steps,
+                                   os.path.join(out, "run_%06d" % run_id) if snapshots else None, checkpoint, cache)
+                       for run_id, (params, seed) in enumerate(runs)]
+            for future in as_completed(futures):
+                run_id, data = future.result()
+                params, seed = runs[run_id]
+                filename = "run_%06d.csv" % run_id
+                data.to_csv(os.path.join(out, filename), index_label="tick")
+                writer.writerow([run_id] + [params[name] for name in names] + [seed, filename])
+                index.flush()
+    return len(runs)
+
+
+def run_series(params, seed, steps):
+    '''
+    Run a single model until no INFECTIOUS cells are left, for at most
+    `steps` ticks.
+    :return: arrays of the Infectious and Removed share at every tick
+    '''
+    global worker_model
+    if worker_model is None:
+        worker_model = EpiDyn(seed=seed, **params)
+    else:
+        worker_model.reset(seed=seed, output=None, **params)
+    while worker_model.running and worker_model.counter < steps:
+        worker_model.step()
+    worker_model.close()
+    series = worker_model.datacollector.model_vars
+    return np.array(series["Infectious"]), np.array(series["Removed"])
+
+
+def run_ensembles(values, seeds, steps, out, tolerance, min_runs=10, confidence=0.95, workers=None):
+    '''
+    Run every parameter combination until its Ensemble has converged or it
+    has been run once per seed, and write the statistics of every combination.
+    A combination is written and dropped as soon as it is finished, and only
+    as many combinations are started as keep the workers busy, so memory
+    does not grow with the number of combinations.
+    :param seeds: the seeds of the replicates, used in order
+    :param tolerance: largest half width of the confidence intervals, see
+                      Ensemble.converged
+    :return: dict of combination id -> number of runs
+    '''
+    os.makedirs(out, exist_ok=True)
+    combinations = parameter_grid(values)
+    names = sorted(values)
+    workers = workers or os.cpu_count()
+    # The Ensembles of the combinations that are being run
+    active = {}
+    submitted = {}
+    runs = {}
+    started = 0
+    with open(os.path.join(out, "ensembles.csv"), "w", newline="") as index, \
+            ProcessPoolExecutor(max_workers=workers) as pool:
+        writer = csv.writer(index)
+        writer.writerow(ensemble_header(names))
+        pending = {}
+
+        def needs_runs(i):
+            # At most `workers` runs of a combination are in flight, so few
+            # runs are done after it has converged
+            ensemble = active[i]
+            return (not ensemble.converged(tolerance, confidence, min_runs) and submitted[i] < len(seeds)
+                    and submitted[i] - ensemble.runs < workers)
+
+        while True:
+            # Keep every worker busy with a run of an active combination or else of a new one
+            while len(pending) < 2 * workers:
+                i = next((i for i in active if needs_runs(i)), None)
+                if i is None:
+                    if started == len(combinations):
+                        break
+                    i = started
+                    started += 1
+                    active[i] = Ensemble(steps)
+                    submitted[i] = 0
+                pending[pool.submit(run_series, combinations[i], seeds[submitted[i]], steps)] = i
+                submitted[i] += 1
+            if not pending:
+                break
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                i = pending.pop(future)
+                ensemble = active[i]
+                ensemble.add(*future.result())
+                if submitted[i] == ensemble.runs and not needs_runs(i):
+                    write_ensemble(writer, i, combinations[i], ensemble, names, out, tolerance, confidence, min_runs)
+                    index.flush()
+                    runs[i] = ensemble.runs
+                    del active[i]
+    return runs
+
+
+# The quantiles written for every statistic
+QUANTILES = (0.05, 0.5, 0.95)
+
+
+def ensemble_header(names):
+    '''
+    The columns of ensembles.csv.
+    '''
+    return (["ensemble_id"] + names + ["runs", "stopped", "converged", "halfwidth"]
+            + ["%s_%s" % (name, stat) for name in ("peak", "peak_time")
+               for stat in ("mean", "variance") + tuple("q%g" % q for q in QUANTILES)] + ["file"])
+
+
+def write_ensemble(writer, i, params, ensemble, names, out, tolerance, confidence, min_runs):
+    '''
+    Write the per tick statistics of one combination to <out>/ensemble_<id>.csv
+    and its row of ensembles.csv.
+    '''
+    summary = ensemble.summary(QUANTILES)
+    filename = "ensemble_%06d.csv" % i
+    columns = {"%s_%s" % (name, stat): values for name in ("Infectious", "Removed")
+               for stat, values in summary[name].items()}
+    pd.DataFrame(columns).to_csv(os.path.join(out, filename), index_label="tick")
+    writer.writerow([i] + [params[name] for name in names]
+                    + [ensemble.runs, ensemble.stopped,
+                       int(ensemble.converged(tolerance, confidence, min_runs)), ensemble.halfwidth(confidence)]
+                    + [float(value) for name in ("peak", "peak_time") for value in summary[name].values()]
+                    + [filename])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    for name, kind in PARAMETERS.items():
+        parser.add_argument("--" + name, type=kind, nargs="+", help="value(s) to sweep")
+    parser.add_argument("--replicates", type=int, default=1, help="runs per combination, seeds seed..seed+replicates-1")
+    parser.add_argument("--seed", type=int, default=0, help="first seed")
+    parser.add_argument("--seeds", type=int, nargs="+", help="explicit seeds (overrides --replicates/--seed)")
+    parser.add_argument("--steps", type=int, default=100, help="ticks per run")
+    parser.add_argument("--workers", type=int, help="worker processes (default: all cores)")
+    parser.add_argument("--out", default="sweep_output", help="output directory")
+    parser.add_argument("--snapshots", action="store_true", help="also write the state grid of every tick")
+    parser.add_argument("--checkpoint", help="checkpoint file to continue every run from")
+    parser.add_argument("--cache", help="directory of the result cache")
+    parser.add_argument("--cache-size", type=int, default=1024, help="size of the result cache in MB")
+    parser.add_argument("--tolerance", type=float,
+                        help="only keep statistics, adding replicates until the confidence intervals are this narrow")
+    parser.add_argument("--min-replicates", type=int, default=10, help="runs per combination before stopping early")
+    parser.add_argument("--confidence", type=float, default=0.95, help="level of the confidence intervals")
+    args = parser.parse_args(argv)
+
+    values = {name: getattr(args, name) for name in PARAMETERS if getattr(args, name) is not None}
+    seeds = args.seeds if args.seeds is not None else list(range(args.seed, args.seed + args.replicates))
+    if args.tolerance is not None:
+        # Ensemble runs keep nothing but their curves, and always start at tick 0
+        for name in ("snapshots", "checkpoint", "cache"):
+            if getattr(args, name):
+                parser.error("--%s cannot be combined with --tolerance" % name)
+        runs = run_ensembles(values, seeds, args.steps, args.out, args.tolerance, args.min_replicates,
+                             args.confidence, args.workers)
+        print("%d ensembles of %d runs in total written to %s" % (len(runs), sum(runs.values()), args.out))
+        return
+    cache = ResultCache(args.cache, args.cache_size * 1024 ** 2) if args.cache else None
+    count = run_sweep(values, seeds, args.steps, args.out, args.workers, args.snapshots, args.checkpoint, cache)
+    print("%d runs written to %s" % (count, args.out))
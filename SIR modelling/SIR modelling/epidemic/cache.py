@@ -0,0 +1,248 @@
+'''
+Content-addressed on-disk cache of finished EpiDyn runs.
+
+    cache = ResultCache("epidemic_cache", max_bytes=2 * 1024 ** 3)
+    run = cache.run({"p_infect": 0.25, "groupsize": 4}, seed=1, steps=100)
+    run.summary()["Infectious"]
+
+Every run is stored under the SHA-256 of its full parameter set (defaults
+filled in), its seed, its number of ticks and the model version, a hash of
+the source of the modules that decide the outcome of a run. Entries are run
+directories in the format of storage.py, with or without snapshots. They are
+written to a temporary directory and renamed into place, so several
+processes can fill the same cache at once; when the cache grows beyond
+max_bytes the least recently used entries are removed.
+'''
+import hashlib
+import inspect
+import json
+import os
+import shutil
+import uuid
+import weakref
+
+import numpy as np
+
+from .model import EpiDyn
+from .storage import RunReader, RunWriter
+
+# The modules whose source decides the outcome of a run
+MODEL_MODULES = ("cell", "engine", "groups", "model", "neighbourhood", "strips")
+
+# Parameters that do not change the outcome of a run
+IGNORED = ("dummy", "seed", "output", "snapshot_chunk", "compress", "profile", "trace")
+
+_version = None
+
+
+def model_version():
+    '''
+    Hash of the source of MODEL_MODULES, so a change to the model
+    invalidates every cached run.
+    '''
+    global _version
+    if _version is None:
+        digest = hashlib.sha256()
+        directory = os.path.dirname(os.path.abspath(__file__))
+        for name in MODEL_MODULES:
+            with open(os.path.join(directory, name + ".py"), "rb") as f:
+                digest.update(f.read())
+        _version = digest.hexdigest()
+    return _version
+
+
+def default_parameters():
+    '''
+    The default of every EpiDyn parameter.
+    '''
+    return {name: parameter.default for name, parameter in inspect.signature(EpiDyn.__init__).parameters.items()
+            if name != "self"}
+
+
+def full_parameters(params):
+    '''
+    The given parameters with every missing one set to its default, except
+    those that do not change the outcome of a run (IGNORED).
+    '''
+    return {name: value for name, value in dict(default_parameters(), **params).items() if name not in IGNORED}
+
+
+def run_key(params, seed, steps, version=None):
+    '''
+    The cache key of a run.
+    :param params: EpiDyn parameters; missing ones get their default
+    :param seed: int or SeedSequence
+    :param version: model version (default: model_version())
+    :return: hex digest
+    '''
+    defaults = default_parameters()
+    full = {}
+    for name, value in full_parameters(params).items():
+        if name in IGNORED:
+            continue
+        # So that groupswitch=True and 1, or p_death=0 and 0.0, give the same key
+        if isinstance(value, bool):
+            value = int(value)
+        elif isinstance(defaults.get(name), float):
+            value = float(value)
+        full[name] = value
+    if isinstance(seed, np.integer):
+        seed = int(seed)
+    elif isinstance(seed, np.random.SeedSequence):
+        seed = {"entropy": seed.entropy, "spawn_key": list(seed.spawn_key)}
+    blob = json.dumps({"params": full, "seed": seed, "steps": steps, "version": version or model_version()},
+                      sort_keys=True)
+    return hashlib.sha256(blob.encode()).hexdigest()
+
+
+def directory_size(path):
+    '''
+    Total size of the files below path, in bytes.
+    '''
+    return sum(os.path.getsize(os.path.join(root, name)) for root, _, names in os.walk(path) for name in names)
+
+
+class ResultCache:
+    '''
+    Runs EpiDyn only for the parameters, seed and number of ticks it has not
+    seen before.
+    '''
+
+    def __init__(self, path, max_bytes=1024 ** 3):
+        '''
+        :param path: cache directory, created when needed
+        :param max_bytes: size above which the least recently used runs are removed
+        '''
+        self.path = path
+        self.max_bytes = max_bytes
+        os.makedirs(os.path.join(path, "tmp"), exist_ok=True)
+
+    def entry(self, key):
+        return os.path.join(self.path, key[:2], key)
+
+    def get(self, params, seed, steps, snapshots=False):
+        '''
+        The cached run, or None.
+        :param snapshots: only return a run that has its snapshots
+        :return: RunReader
+        '''
+        path = self.entry(run_key(params, seed, steps))
+        try:
+            run = RunReader(path)
+            # Read now, as another process may evict the entry at any time
+            run.summary()
+            # The modification time of an entry is its last use
+            os.utime(path)
+        except (OSError, ValueError):
+            # Not cached, or removed by another process while reading
+            return None
+        if snapshots and not run.snapshots:
+            return None
+        return run
+
+    def run(self, params, seed, steps, snapshots=False, model=None):
+        '''
+        The run from the cache, simulated and stored first when it is missing.
+        Runs without a seed are never the same, so they are always simulated
+        and not stored: their directory is removed once the returned reader
+        is no longer used.
+        :param model: EpiDyn to reuse with reset() for a missing run
+        :return: RunReader
+        '''
+        # Every parameter is passed on, as reset() keeps those that are
+        # left out as they were in the model's previous run
+        params = full_parameters(params)
+        if seed is not None:
+            run = self.get(params, seed, steps, snapshots)
+            if run is not None:
+                return run
+        key = run_key(params, seed, steps)
+        temporary = os.path.join(self.path, "tmp", "%s.%d.%s" % (key, os.getpid(), uuid.uuid4().hex))
+        output = temporary if snapshots else None
+        if model is None:
+            model = EpiDyn(seed=seed, output=output, **params)
+        else:
+            model.reset(seed=seed, output=output, **params)
+        for _ in range(steps):
+            model.step()
+        model.close()
+        if not snapshots:
+            columns = list(model.datacollector.model_vars)
+            writer = RunWriter(temporary, model.state_grid().shape, columns, snapshots=False)
+            for row in zip(*model.datacollector.model_vars.values()):
+                writer.append(None, dict(zip(columns, row)))
+            writer.close()
+        if seed is None:
+            run = RunReader(temporary)
+            run.summary()
+            weakref.finalize(run, shutil.rmtree, temporary, ignore_errors=True)
+            return run
+        return RunReader(self.store(key, temporary))
+
+    def store(self, key, temporary):
+        '''
+        Move a finished run directory into the cache.
+        :return: path of the entry
+        '''
+        path = self.entry(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        if os.path.exists(path):
+            # A run without snapshots is replaced by one with them
+            self.remove(path)
+        try:
+            os.rename(temporary, path)
+        except OSError:
+            # Another process stored the same run first
+            shutil.rmtree(temporary, ignore_errors=True)
+        self.evict(keep=path)
+        return path
+
+    def remove(self, path):
+        '''
+        Take an entry out of the cache; it is renamed first, so no reader
+        ever sees half of it.
+        '''
+        trash = os.path.join(self.path, "tmp", "removed." + uuid.uuid4().hex)
+        try:
+            os.rename(path, trash)
+        except OSError:
+            return
+        shutil.rmtree(trash, ignore_errors=True)
+
+    def entries(self):
+        '''
+        (last use, size, path) of every cached run.
+        '''
+        entries = []
+        for prefix in os.listdir(self.path):
+            if prefix == "tmp" or not os.path.isdir(os.path.join(self.path, prefix)):
+                continue
+            for key in os.listdir(os.path.join(self.path, prefix)):
+                path = os.path.join(self.path, prefix, key)
+                try:
+                    entries.append((os.path.getmtime(path), directory_size(path), path))
+                except OSError:
+                    continue
+        return entries
+
+    def evict(self, keep=None):
+        '''
+        Remove the least recently used runs until the cache fits in max_bytes.
+        :param keep: path of an entry that is never removed (the one just stored)
+        '''
+        entries = sorted(self.entries())
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            if path == keep:
+                continue
+            self.remove(path)
+            total -= size
+
+    def clear(self):
+        '''
+        Remove every cached run.
+        '''
+        for _, _, path in self.entries():
+            self.remove(path)
@@ -1,31 +1,101 @@
-from mesa import Agent
-import numpy as np
-import random as rd
+class Cell:
+    '''Represents a single individual in the simulation.
 
-
-class Cell(Agent):
-    '''Represents a single individual in the simulation.'''
+    The state, next state and parameters of all cells are kept by the model
+    in NumPy arrays (cell_state, cell_next, cell_p_infect, cell_p_death,
+    cell_groupsize); a Cell only holds its model and its index into them,
+    which is also its flat id x * grid.height + y. It has the attributes
+    Mesa needs of an agent (unique_id, pos) but, unlike a Mesa Agent, no
+    __dict__, so a million cells take little memory.
+    '''
 
     SENSITIVE = 0
     INFECTIOUS = 1
     REMOVED = 2
     NEIGHBOUR = 3
 
-    def __init__(self, pos, model, spatial, unique_id, init_state=SENSITIVE):
+    # cell_next of a cell that has not been stepped yet
+    NO_STATE = -1
+
+    __slots__ = ("model", "index")
+
+    def __init__(self, model, index):
+        '''
+        Create the cell with the given index into the arrays of the model.
+        '''
+        self.model = model
+        self.index = index
+
+    @property
+    def x(self):
+        return self.index // self.model.grid.height
+
+    @property
+    def y(self):
+        return self.index % self.model.grid.height
+
+    @property
+    def pos(self):
+        return divmod(self.index, self.model.grid.height)
+
+    @pos.setter
+    def pos(self, pos):
+        # Set by Grid.place_agent; cells never move, so it follows from the index
+        pass
+
+    @property
+    def unique_id(self):
+        x, y = self.pos
+        return (x + y) * (x + y + 1) // 2 + y
+
+    @property
+    def spatial(self):
+        return self.model.spatial
+
+    @property
+    def state(self):
+        return int(self.model.cell_state[self.index])
+
+    @state.setter
+    def state(self, state):
+        self.model.cell_state[self.index] = state
+
+    @property
+    def next_state(self):
         '''
-        Create a cell, in the given state, at the given x, y position.
+        The state computed by step(), or None before that.
         '''
-        super().__init__(pos, model)
-        self.x, self.y = pos
-        self.spatial = spatial
-        self.unique_id = unique_id
-        self.state = init_state
-        self._nextState = None
+        state = int(self.model.cell_next[self.index])
+        return None if state == self.NO_STATE else state
+
+    @property
+    def p_infect(self):
+        return float(self.model.cell_p_infect[self.index])
+
+    @p_infect.setter
+    def p_infect(self, p_infect):
+        self.model.cell_p_infect[self.index] = p_infect
+
+    @property
+    def p_death(self):
+        return float(self.model.cell_p_death[self.index])
+
+    @p_death.setter
+    def p_death(self, p_death):
+        self.model.cell_p_death[self.index] = p_death
+
+    @property
+    def groupsize(self):
+        return int(self.model.cell_groupsize[self.index])
+
+    @groupsize.setter
+    def groupsize(self, groupsize):
+        self.model.cell_groupsize[self.index] = groupsize
 
     @property
     def isInfectious(self):
         return self.state == self.INFECTIOUS
-    
+
     @property
     def isNeighbour(self):
         return self.state == self.NEIGHBOUR
@@ -36,92 +106,76 @@ class Cell(Agent):
 
     @property
     def neighbours(self):
-        return self.model.grid.neighbor_iter((self.x, self.y), True)
-
-    def newneighbours(self, amount):
-        for neighbour in self.neighbourhood:
-            if neighbour.unique_id in self.model.neighbourdic:
-                if len(self.model.neighbourdic[neighbour.unique_id]) >= self.groupsize:
-                    self.neighbourhood.remove(neighbour)
-        if self.neighbourhood:
-            if len(self.neighbourhood) > amount:
-                self.newneighbourlist = rd.choices(self.neighbourhood, k=amount)
-            else:
-                self.newneighbourlist = self.neighbourhood
-            for newneighbour in self.newneighbourlist:
-                if newneighbour in self.model.neighbourdic:
-                    self.model.neighbourdic[newneighbour.unique_id].append(self)
-                else:
-                    self.model.neighbourdic[newneighbour.unique_id] = [self]
-            return self.newneighbourlist
-        else:
-            return []
+        return self.model.grid.neighbor_iter(self.pos, True)
+
+    def contacts(self):
+        '''
+        Ids of the cells this cell can meet this tick.
+        '''
+        #Once quarantine has started only the own group can be met
+        #otherwise the neighbourhood is looked up in the index EpiDyn built at construction
+        if self.model.groups is not None:
+            return self.model.groups.members(self.index)
+        elif self.model.spatial:
+            return self.model.neighbour_index[self.index]
+        # In the non-spatial setting, random cells are met instead of
+        # neigboring cells;  in this way "mean field" is simulated
+        # (drawn by the model for all cells at once)
+        return self.model.contacts[self.index]
 
     def step(self):
-        
+
         '''
         Compute if the cell will be INFECTIOUS or REMOVED at the next tick.
         With simultaneous updating, he state is not changed here,
-        but is just computed and stored in self._nextState,
+        but is just computed and stored in the model's cell_next,
         because the current state may still be necessary for our neighbors
         to calculate their next state.
         '''
+        model = self.model
+        i = self.index
+        states = model.cell_state
+        state = states[i]
 
-        # Get the neighbors and apply the rules on whether to be INFECTIOUS or SENSITIVE
-        # at the next tick.
-        #In order to use our newneigbours list, we need to get it compatitable with the way 
-        #in which mesa defines a neigbourhood here
-        if self.spatial:
-            self.neighbourhood = self.model.grid.iter_neighborhood(self.pos, moore=True, radius=2)
-            self.neighbourhood = self.model.grid.get_cell_list_contents(self.neighbourhood)
-
-        # In the non-spatial setting, th he next function is using random cells instead
-        # neigboring cells;  in this way "mean field" is simulated
+        # Exposure only lasts for one tick
+        if state == self.NEIGHBOUR:
+            model.state_counts[self.NEIGHBOUR] -= 1
+            model.state_counts[self.SENSITIVE] += 1
+            states[i] = state = self.SENSITIVE
 
-        else:
-            self.neighbourhood = rd.sample(self.model.measure_CA, self.groupsize)
-            
-        if self.model.counter >= self.model.quarantine_delay:
-            if self.model.groupswitch == True or self.model.counter == self.model.quarantine_delay:
-                if (self.model.counter - self.model.quarantine_delay) % self.model.switchperx == 0: 
-                    if self.unique_id in self.model.neighbourdic:
-                        if len(self.model.neighbourdic[self.unique_id]) < self.groupsize:
-                            neighboursrequired = self.groupsize - len(self.model.neighbourdic[self.unique_id])
-                            for newneighbour in self.newneighbours(neighboursrequired):
-                                self.model.neighbourdic[self.unique_id].append(newneighbour)
-                    else:
-                        self.model.neighbourdic[self.unique_id] = self.newneighbours(self.groupsize)
-        
-                    self.smallerneighbourhood = self.model.neighbourdic[self.unique_id]
-        else:
-            self.smallerneighbourhood = self.neighbourhood
-        self.rd_neighbour = rd.choice(self.smallerneighbourhood)
         # Assuming default nextState is unchanged
-        # Check if state will be changed
-        if self.isNeighbour:
-           self.state = self.SENSITIVE
-           
-        self._nextState = self.state
-            
-        if self.isSensitive:
-            for neighbour in self.smallerneighbourhood:
-                    if neighbour.isInfectious:
-                        self._nextState = self.NEIGHBOUR
-            if self.rd_neighbour.state == self.rd_neighbour.INFECTIOUS:
-                if np.random.random() < self.p_infect:
-                    self._nextState = self.INFECTIOUS
-        
-        if self.isInfectious:
-            if np.random.random() < self.p_death:
-                self._nextState = self.REMOVED
-
-        if self.model.schedule_type == "Random":
+        # Check if state will be changed; the random numbers of this tick were
+        # drawn by the model in bulk
+        next_state = state
+        if state == self.SENSITIVE:
+            contacts = self.contacts()
+            if len(contacts):
+                contact_states = states[contacts]
+                if (contact_states == self.INFECTIOUS).any():
+                    next_state = self.NEIGHBOUR
+                # The contact that is met, at random
+                if contact_states[int(model.picks[i] * len(contacts))] == self.INFECTIOUS:
+                    if model.draws[i] < model.cell_p_infect[i]:
+                        next_state = self.INFECTIOUS
+        elif state == self.INFECTIOUS:
+            if model.draws[i] < model.cell_p_death[i]:
+                next_state = self.REMOVED
+        model.cell_next[i] = next_state
+
+        if model.schedule_type == "Random":
             self.advance()
 
     def advance(self):
         '''
         Simultaneously set the state to the new computed state -- computed in step().
+        The model keeps count of the cells per state, so only changes are counted.
         '''
-        self.state = self._nextState
-        
-
+        model = self.model
+        i = self.index
+        state = model.cell_state[i]
+        next_state = model.cell_next[i]
+        if next_state != state:
+            model.transitions += 1
+            model.state_counts[state] -= 1
+            model.state_counts[next_state] += 1
+            model.cell_state[i] = next_state
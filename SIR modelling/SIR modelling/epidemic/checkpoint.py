@@ -0,0 +1,102 @@
+'''
+Checkpoints of a running EpiDyn, to pause, resume or fork a run.
+
+    save_checkpoint(model, "day25.npz")
+    model = load_checkpoint("day25.npz")                     # continues bit-identically
+    branches = fork("day25.npz", [{"groupsize": 2}, {"groupsize": 6, "switchperx": 5}])
+
+A checkpoint is a single .npz file holding the state grid, the quarantine
+groups, the collected series and, as JSON, the parameters, the tick counter
+and the state of every random generator. Without a new seed a loaded model
+draws the same random numbers the saved one would have drawn, so branches
+forked from one checkpoint differ only by their parameters.
+'''
+import json
+
+import numpy as np
+
+from .groups import ContactGroups
+from .model import EpiDyn
+from .storage import RunWriter
+
+# Parameters that only concern the saved run itself; a loaded model gets
+# them from load_checkpoint and otherwise uses the defaults
+RUN_PARAMETERS = tuple(EpiDyn.run_parameters)
+
+
+def save_checkpoint(model, path):
+    '''
+    Write the complete state of the model, between two ticks, to `path`.
+    '''
+    sequence = model.seed_sequence
+    meta = {"params": {name: value for name, value in model.params.items() if name not in RUN_PARAMETERS},
+            "seed": {"entropy": sequence.entropy, "spawn_key": list(sequence.spawn_key)},
+            "counter": model.counter,
+            "steps": model.schedule.steps,
+            "running": model.running,
+            "rng": model.rng.bit_generator.state,
+            "random": model.random.getstate(),
+            "strips": model.engine.rng_states() if hasattr(model.engine, "rng_states") else None}
+    arrays = {"states": model.state_grid()}
+    if model.groups is not None:
+        arrays["group_indptr"] = model.groups.indptr
+        arrays["group_indices"] = model.groups.indices
+    for name, values in model.datacollector.model_vars.items():
+        arrays["series_" + name] = np.array(values, dtype=np.float64)
+    with open(path, "wb") as f:
+        np.savez(f, meta=np.array(json.dumps(meta)), **arrays)
+
+
+def load_checkpoint(path, seed=None, output=None, profile=False, trace=None, **params):
+    '''
+    Build a model that continues from a checkpoint.
+    :param seed: reseed the run from here on; by default the saved random
+                 generators are restored, for a bit-identical continuation
+    :param output: directory to write the ticks from the checkpoint on to
+    :param params: parameters to change for the rest of the run, e.g. the
+                   quarantine policy; the structure of the field can not change
+    :return: the EpiDyn
+    '''
+    with np.load(path) as data:
+        meta = json.loads(str(data["meta"]))
+        arrays = {name: data[name] for name in data.files if name != "meta"}
+    changed = [name for name in EpiDyn.structure if name in params and params[name] != meta["params"][name]]
+    if changed:
+        raise ValueError("Can not change %s of a checkpoint" % ", ".join(changed))
+
+    saved_seed = np.random.SeedSequence(meta["seed"]["entropy"], spawn_key=tuple(meta["seed"]["spawn_key"]))
+    model = EpiDyn(seed=saved_seed if seed is None else seed, profile=profile, trace=trace,
+                   **dict(meta["params"], **params))
+    model.set_states(arrays["states"].astype(np.int8))
+    if "group_indptr" in arrays:
+        model.groups = ContactGroups(arrays["group_indptr"], arrays["group_indices"])
+    model.counter = meta["counter"]
+    model.schedule.steps = model.schedule.time = meta["steps"]
+    model.running = meta["running"]
+    for name in model.datacollector.model_vars:
+        model.datacollector.model_vars[name] = arrays["series_" + name].tolist()
+
+    if seed is None:
+        model.rng.bit_generator.state = meta["rng"]
+        version, internal, gauss = meta["random"]
+        model.random.setstate((version, tuple(internal), gauss))
+        if meta["strips"] is not None:
+            model.engine.set_rng_states(meta["strips"])
+
+    if output is not None:
+        model.output = RunWriter(output, model.state_grid().shape, model.datacollector.model_reporters,
+                                 chunk=model.params["snapshot_chunk"], compress=model.params["compress"])
+        model.write_output()
+        model.params["output"] = output
+    return model
+
+
+def fork(path, branches):
+    '''
+    Continue one checkpoint as several branches, so a shared warm-up is only
+    simulated once.
+    :param branches: list of dicts of keyword arguments for load_checkpoint
+                     (changed parameters, and optionally seed or output)
+    :return: list of EpiDyn, one per branch
+    '''
+    return [load_checkpoint(path, **branch) for branch in branches]
@@ -0,0 +1,141 @@
+import numpy as np
+
+from .cell import Cell
+from .neighbourhood import neighbourhood_offsets
+
+
+def count_infectious_neighbours(infectious, radius=2):
+    '''
+    Count, for every cell of the torus, the INFECTIOUS cells in its
+    radius-r Moore neighbourhood (the cell itself not included).
+    :param infectious: boolean array of shape (height, width), or a stack of
+                       such fields of shape (..., height, width)
+    :return: int16 array of the same shape
+    '''
+    infectious = infectious.astype(np.int16)
+    # The box sum is separable: first along x, then along y
+    rows = sum(np.roll(infectious, d, axis=-2) for d in range(-radius, radius + 1))
+    box = sum(np.roll(rows, d, axis=-1) for d in range(-radius, radius + 1))
+    return box - infectious
+
+
+def reset_exposure(state):
+    '''
+    Exposure only lasts for one tick: NEIGHBOUR cells are SENSITIVE again.
+    '''
+    state[state == Cell.NEIGHBOUR] = Cell.SENSITIVE
+
+
+def count_contacts(field, shape, groups=None, spatial=True, radius=2, moore=True, index=None, groupsize=4, rngs=(),
+                   rows=None):
+    '''
+    Count the INFECTIOUS contacts of every counted cell; a cell meets one of
+    its `contacts` at random, so it is infected with p_infect * counts / contacts
+    (never, when it has no contacts at all).
+    :param field: the states of the torus, (height, width), or a stack of
+                  such fields of shape (replicates, height, width)
+    :param shape: shape of the counted cells: that of field, or of a strip of its rows
+    :param groups: ContactGroups of the counted cells, in quarantine; its
+                   members are ids into field.ravel()
+    :param index: neighbour_index of the counted cells of a field, for von
+                  Neumann neighbourhoods
+    :param rngs: one numpy.random.Generator per field, from which every
+                 counted cell draws `groupsize` random contacts in the
+                 non-spatial setting
+    :param rows: the rows of field holding the counted cells plus `radius`
+                 halo rows on either side, for Moore neighbourhoods
+                 (default: all rows, the counted cells being the whole torus)
+    :return: counts, array of the given shape, and contacts, such an array or a number
+    '''
+    fields = field.reshape(-1, field.shape[-2] * field.shape[-1])
+    if groups is not None:
+        infectious = field.reshape(-1)[groups.indices] == Cell.INFECTIOUS
+        counts = np.bincount(groups.rows, weights=infectious, minlength=len(groups)).astype(np.int32)
+        contacts = groups.sizes().reshape(shape)
+    elif spatial:
+        if moore and rows is None:
+            counts = count_infectious_neighbours(field == Cell.INFECTIOUS, radius)
+        elif moore:
+            halo = field[..., rows, :] == Cell.INFECTIOUS
+            counts = count_infectious_neighbours(halo, radius)[..., radius:len(rows) - radius, :]
+        else:
+            counts = (fields[:, index] == Cell.INFECTIOUS).sum(axis=-1)
+        contacts = len(neighbourhood_offsets(radius, moore))
+    else:
+        # One field at a time, so the sample of a field stays in the cache
+        counts = np.empty((len(fields), int(np.prod(shape)) // len(fields)), dtype=np.int64)
+        for values, rng, count in zip(fields, rngs, counts):
+            sample = rng.integers(0, len(values), size=(len(count), groupsize))
+            count[:] = (values[sample] == Cell.INFECTIOUS).sum(axis=1)
+        contacts = groupsize
+    return counts.reshape(shape), contacts
+
+
+def apply_rules(state, counts, contacts, draws, p_infect, p_death):
+    '''
+    The Cell transition rules for an array of cells.
+    :param state: states, with NEIGHBOUR already reset to SENSITIVE
+    :param counts: number of INFECTIOUS contacts of every cell
+    :param contacts: number of contacts of every cell (or of all cells)
+    :param draws: uniform random number of every cell
+    :return: the next states
+    '''
+    sensitive = state == Cell.SENSITIVE
+    next_state = state.copy()
+    next_state[sensitive & (counts > 0)] = Cell.NEIGHBOUR
+    next_state[sensitive & (draws * contacts < p_infect * counts)] = Cell.INFECTIOUS
+    next_state[(state == Cell.INFECTIOUS) & (draws < p_death)] = Cell.REMOVED
+    return next_state
+
+
+class GridEngine:
+    '''
+    Keeps the state of the whole torus in one int8 array and applies the
+    Cell transition rules to all cells at once (simultaneous updating).
+    '''
+
+    def __init__(self, model, height, width):
+        '''
+        Create an all-SENSITIVE field of (height, width) cells; the state is
+        indexed [x, y] just like the Grid of the Cell engine. The parameters
+        of the run are read from the model.
+        '''
+        self.model = model
+        self.shape = (height, width)
+        self.size = height * width
+        self.state = np.full(self.shape, Cell.SENSITIVE, dtype=np.int8)
+
+    def count_states(self):
+        '''
+        Number of cells per state, indexed by state.
+        '''
+        return np.bincount(self.state.ravel(), minlength=4).tolist()
+
+    def step(self):
+        '''
+        Compute the next state of every cell and apply it.
+        '''
+        model = self.model
+        state = self.state
+        profiler = model.profiler
+
+        reset_exposure(state)
+        with profiler.phase("contacts"):
+            # Moore neighbourhoods are counted without the neighbour index
+            index = None if model.moore else model.neighbour_index
+            counts, contacts = count_contacts(state, self.shape, model.groups, model.spatial, model.radius, model.moore,
+                                              index, model.groupsize, [model.rng])
+
+        with profiler.phase("transition"):
+            draws = model.rng.random(self.shape)
+            next_state = apply_rules(state, counts, contacts, draws, model.p_infect, model.p_death)
+            self.state = next_state
+            model.state_counts = self.count_states()
+        if profiler.enabled:
+            model.transitions = int(np.count_nonzero(next_state != state))
+
+    def stop(self):
+        '''
+        Release what the engine holds outside of the model; nothing here.
+        '''
+        pass
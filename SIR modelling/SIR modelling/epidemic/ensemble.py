@@ -0,0 +1,187 @@
+'''
+Running statistics of an ensemble of EpiDyn runs of one configuration.
+
+    ensemble = Ensemble(steps=100)
+    for seed in range(1000):
+        ensemble.add(infectious, removed)       # the DataCollector columns of a run
+        if ensemble.converged(0.01):
+            break
+    ensemble.summary()
+
+Every finished run is folded into the statistics and can then be thrown
+away: the memory used depends on the number of ticks, not on the number
+of runs. Means and variances are Welford running moments; the quantiles
+of the curves come from sketches with a relative error of 2%, those of the
+peak height and time to peak are exact (one number per run). A run that
+stopped early, because no INFECTIOUS cells were left, is completed with its
+final state.
+'''
+from statistics import NormalDist
+
+import numpy as np
+
+
+class RunningMoments:
+    '''
+    Mean and variance of a stream of equally shaped arrays (Welford).
+    '''
+
+    def __init__(self, shape=()):
+        self.count = 0
+        self.mean = np.zeros(shape)
+        self.m2 = np.zeros(shape)
+
+    def add(self, values):
+        self.count += 1
+        delta = values - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (values - self.mean)
+
+    def variance(self):
+        '''
+        The sample variance (zero for fewer than two values).
+        '''
+        if self.count < 2:
+            return np.zeros_like(self.m2)
+        return self.m2 / (self.count - 1)
+
+    def halfwidth(self, confidence=0.95):
+        '''
+        Half the width of the normal confidence interval of the mean.
+        '''
+        if self.count < 2:
+            return np.full_like(self.m2, np.inf)
+        z = NormalDist().inv_cdf(0.5 + confidence / 2)
+        return z * np.sqrt(self.variance() / self.count)
+
+
+class QuantileSketch:
+    '''
+    Quantiles of a stream of equally shaped arrays of non-negative values,
+    with a relative error of at most `relative` (a DDSketch): the values are
+    counted in logarithmically spaced bins, so small shares such as 1% of
+    the cells are resolved as finely as large ones. Values up to `smallest`
+    count as zero.
+    '''
+
+    def __init__(self, shape=(), relative=0.02, smallest=1e-5, largest=1.0):
+        self.shape = shape
+        self.smallest = smallest
+        self.gamma = (1 + relative) / (1 - relative)
+        # Bin 0 holds the values up to smallest, bin i > 0 those in
+        # (smallest * gamma^(i-1), smallest * gamma^i]
+        self.bins = int(np.ceil(np.log(largest / smallest) / np.log(self.gamma))) + 1
+        # One histogram per element
+        self.counts = np.zeros((int(np.prod(shape)), self.bins), dtype=np.int32)
+
+    def add(self, values):
+        values = np.asarray(values, dtype=np.float64).reshape(-1)
+        bins = np.zeros(len(values), dtype=np.int64)
+        large = values > self.smallest
+        bins[large] = np.ceil(np.log(values[large] / self.smallest) / np.log(self.gamma))
+        bins = np.clip(bins, 0, self.bins - 1)
+        self.counts[np.arange(len(bins)), bins] += 1
+
+    def quantiles(self, qs):
+        '''
+        :param qs: the quantiles to estimate, between 0 and 1
+        :return: array of shape (len(qs),) + shape
+        '''
+        cumulative = np.cumsum(self.counts, axis=-1, dtype=np.int64)
+        total = cumulative[:, -1]
+        # The value of every bin that is within the relative error of all its values
+        values = np.concatenate([[0.0], self.smallest * self.gamma ** np.arange(1, self.bins) * 2 / (1 + self.gamma)])
+        estimates = []
+        for q in qs:
+            rank = q * (total - 1)
+            # The first bin with more values than the rank
+            index = np.minimum((cumulative <= rank[:, None]).sum(axis=-1), self.bins - 1)
+            estimates.append(values[index].reshape(self.shape))
+        return np.array(estimates)
+
+
+class Ensemble:
+    '''
+    Statistics of the Infectious and Removed curves, the peak height and the
+    time to peak of the runs of one configuration.
+    '''
+
+    # The statistics of which the confidence interval decides convergence
+    SHARES = ("Infectious", "Removed", "peak")
+
+    def __init__(self, steps, relative=0.02):
+        '''
+        :param steps: number of ticks of every run; runs are steps + 1 values long
+        :param relative: relative error of the quantiles of the curves; their
+                         sketches take 1.2 MB for 500 ticks at 2%
+        '''
+        self.steps = steps
+        self.length = steps + 1
+        self.moments = {"Infectious": RunningMoments(self.length),
+                        "Removed": RunningMoments(self.length),
+                        "peak": RunningMoments(),
+                        "peak_time": RunningMoments()}
+        self.sketches = {"Infectious": QuantileSketch(self.length, relative),
+                         "Removed": QuantileSketch(self.length, relative)}
+        # The peak height and time of every run
+        self.peaks = {"peak": [], "peak_time": []}
+        # Number of runs that ended before `steps` ticks
+        self.stopped = 0
+
+    @property
+    def runs(self):
+        return self.moments["peak"].count
+
+    def add(self, infectious, removed):
+        '''
+        Fold one run into the statistics.
+        :param infectious, removed: the Infectious and Removed share at every
+                                    tick of the run, at most steps + 1 of them
+        '''
+        infectious = np.asarray(infectious, dtype=np.float64)[:self.length]
+        removed = np.asarray(removed, dtype=np.float64)[:self.length]
+        if len(infectious) < self.length:
+            # Without INFECTIOUS cells nothing changes any more
+            self.stopped += 1
+            infectious = np.concatenate([infectious, np.zeros(self.length - len(infectious))])
+            removed = np.concatenate([removed, np.full(self.length - len(removed), removed[-1])])
+        peak_time = int(np.argmax(infectious))
+        values = {"Infectious": infectious, "Removed": removed,
+                  "peak": infectious[peak_time], "peak_time": peak_time}
+        for name, value in values.items():
+            self.moments[name].add(value)
+            if name in self.sketches:
+                self.sketches[name].add(value)
+            else:
+                self.peaks[name].append(value)
+
+    def halfwidth(self, confidence=0.95):
+        '''
+        The widest confidence interval (half width) of the mean of the
+        Infectious and Removed share at any tick and of the peak height.
+        '''
+        return max(float(np.max(self.moments[name].halfwidth(confidence))) for name in self.SHARES)
+
+    def converged(self, tolerance, confidence=0.95, min_runs=10):
+        '''
+        Whether more runs are not needed: every interval of halfwidth() is
+        within +/- tolerance (a share of the cells) after at least min_runs runs.
+        '''
+        return self.runs >= min_runs and self.halfwidth(confidence) <= tolerance
+
+    def summary(self, quantiles=(0.05, 0.5, 0.95)):
+        '''
+        :return: dict of statistic name -> dict with the "mean", "variance"
+                 and the given quantiles (keyed "q<quantile>") of that statistic
+        '''
+        result = {}
+        for name, moments in self.moments.items():
+            stats = {"mean": moments.mean, "variance": moments.variance()}
+            if name in self.sketches:
+                estimates = self.sketches[name].quantiles(quantiles)
+            else:
+                estimates = np.quantile(self.peaks[name], quantiles)
+            for q, value in zip(quantiles, estimates):
+                stats["q%g" % q] = value
+            result[name] = stats
+        return result
@@ -0,0 +1,191 @@
+import numpy as np
+
+from .neighbourhood import neighbour_index
+
+
+class ContactGroups:
+    '''
+    The quarantine groups of all cells as a symmetric adjacency in CSR form:
+    the members of cell i are indices[indptr[i]:indptr[i+1]].
+    '''
+
+    def __init__(self, indptr, indices):
+        self.indptr = indptr
+        self.indices = indices
+        # Row of every entry of indices, used to count members per cell
+        self.rows = np.repeat(np.arange(len(indptr) - 1, dtype=np.int32), np.diff(indptr))
+
+    @classmethod
+    def from_edges(cls, size, u, v):
+        '''
+        Build the groups of `size` cells from undirected edges (u[k], v[k]).
+        '''
+        src = np.concatenate([u, v])
+        dst = np.concatenate([v, u])
+        order = stable_order(src)
+        indptr = np.zeros(size + 1, dtype=np.int64)
+        np.cumsum(np.bincount(src, minlength=size), out=indptr[1:])
+        return cls(indptr, dst[order].astype(np.int32))
+
+    @classmethod
+    def concatenate(cls, groups):
+        '''
+        The groups of several populations as one: cell i of the r-th
+        population becomes cell r * n + i, n being the size of a population.
+        '''
+        size = len(groups[0])
+        # Every population's rows start where those of the one before ended
+        starts = np.cumsum([0] + [len(g.indices) for g in groups])
+        indptr = np.concatenate([[0]] + [g.indptr[1:] + start for g, start in zip(groups, starts)])
+        indices = np.concatenate([g.indices + r * size for r, g in enumerate(groups)])
+        return cls(indptr, indices.astype(np.int32))
+
+    def __len__(self):
+        return len(self.indptr) - 1
+
+    def members(self, i):
+        '''
+        Ids of the cells in the group of cell i.
+        '''
+        return self.indices[self.indptr[i]:self.indptr[i + 1]]
+
+    def members_of(self, cells):
+        '''
+        Ids of the group members of all the given cells, concatenated.
+        :param cells: array of cell ids
+        '''
+        start = self.indptr[cells]
+        lengths = self.indptr[cells + 1] - start
+        # Position of every member in indices: the start of its row plus its
+        # place within the row
+        offsets = np.repeat(start - np.cumsum(lengths) + lengths, lengths) + np.arange(lengths.sum())
+        return self.indices[offsets]
+
+    def sizes(self):
+        '''
+        Number of group members of every cell.
+        '''
+        return np.diff(self.indptr)
+
+    def count(self, mask):
+        '''
+        Count, for every cell, the members of its group for which mask is True.
+        :param mask: flat boolean array over all cells
+        '''
+        return np.bincount(self.rows, weights=mask[self.indices], minlength=len(self)).astype(np.int32)
+
+
+def stable_order(values):
+    '''
+    np.argsort(values, kind="stable") for cell ids (integers from 0 to 2**32):
+    NumPy radix sorts 16-bit keys, so the ids are sorted by their low and
+    then by their high 16 bits, which is several times faster.
+    '''
+    order = np.argsort((values & 0xFFFF).astype(np.uint16), kind="stable")
+    if len(values) and values.max() > 0xFFFF:
+        high = (values >> 16).astype(np.uint16)
+        order = order[np.argsort(high[order], kind="stable")]
+    return order
+
+
+def occurrence_rank(values):
+    '''
+    For every element, how often the same value occurred before it.
+    :param values: cell ids
+    '''
+    order = stable_order(values)
+    ordered = values[order]
+    position = np.arange(len(values))
+    first = np.ones(len(values), dtype=bool)
+    first[1:] = ordered[1:] != ordered[:-1]
+    start = np.maximum.accumulate(np.where(first, position, 0))
+    rank = np.empty(len(values), dtype=np.int32)
+    rank[order] = position - start
+    return rank
+
+
+def neighbour_pairs(index, cells=None):
+    '''
+    Every unordered pair of neighbours of a symmetric neighbour index, once.
+    :param cells: ids of the cells of the rows of index (default: all cells)
+    :return: arrays u, v with u[k] < v[k]
+    '''
+    if cells is None:
+        cells = np.arange(len(index), dtype=np.int32)
+    u = np.repeat(cells, index.shape[1])
+    v = index.ravel()
+    keep = u < v
+    return u[keep], v[keep]
+
+
+def torus_pairs(height, width, radius=2, moore=True, chunk=65536):
+    '''
+    neighbour_pairs(neighbour_index(height, width, radius, moore)), in the
+    same order, but looking up `chunk` cells at a time so the neighbour
+    index of the whole torus is never held.
+    :return: arrays u, v with u[k] < v[k]
+    '''
+    size = height * width
+    pairs = [neighbour_pairs(neighbour_index(height, width, radius, moore, cells), cells)
+             for cells in (np.arange(start, min(start + chunk, size), dtype=np.int32)
+                           for start in range(0, size, chunk))]
+    return (np.concatenate([u for u, v in pairs]).astype(np.int32),
+            np.concatenate([v for u, v in pairs]).astype(np.int32))
+
+
+def random_pairs(size, count, rng):
+    '''
+    `count` random distinct pairs of different cells (fewer after dropping
+    the rare repeats), for grouping without any spatial structure.
+    :param rng: numpy.random.Generator
+    :return: arrays u, v with u[k] < v[k]
+    '''
+    u = rng.integers(0, size, size=count, dtype=np.int64)
+    v = rng.integers(0, size, size=count, dtype=np.int64)
+    keys = np.sort(np.minimum(u, v) * size + np.maximum(u, v))
+    keep = np.ones(len(keys), dtype=bool)
+    keep[1:] = keys[1:] != keys[:-1]
+    u, v = np.divmod(keys[keep], size)
+    distinct = u != v
+    return u[distinct].astype(np.int32), v[distinct].astype(np.int32)
+
+
+def form_groups(size, u, v, groupsize, rng):
+    '''
+    Form symmetric contact groups in which nobody has more than `groupsize`
+    members, by a randomized greedy matching on the candidate pairs.
+    Candidate pairs are visited in random order and a pair is linked as long
+    as both cells still have room; the pairs are handled in bulk windows.
+    :param size: number of cells
+    :param u, v: candidate pairs (u[k], v[k]), each unordered pair at most once
+    :param groupsize: maximum number of group members per cell
+    :param rng: numpy.random.Generator
+    :return: ContactGroups
+    '''
+    order = rng.permutation(len(u))
+    u, v = u[order], v[order]
+    # Roughly the number of links needed, so most cells fill up in the first
+    # window and the later windows only look at cells that still have room
+    window = max(size * groupsize // 2, 1)
+
+    degree = np.zeros(size, dtype=np.int32)
+    linked_u, linked_v = [], []
+    while len(u):
+        pu, pv = u[:window], v[:window]
+        # A pair is safe to link when both cells have room for every pair
+        # before it in this window that involves them
+        ends = np.stack([pu, pv], axis=1).ravel()
+        rank = occurrence_rank(ends).reshape(-1, 2)
+        link = (degree[pu] + rank[:, 0] < groupsize) & (degree[pv] + rank[:, 1] < groupsize)
+        linked_u.append(pu[link])
+        linked_v.append(pv[link])
+        degree += np.bincount(ends[np.repeat(link, 2)], minlength=size)
+        # Retry the other pairs of which both cells still have room
+        u = np.concatenate([pu[~link], u[window:]])
+        v = np.concatenate([pv[~link], v[window:]])
+        room = (degree[u] < groupsize) & (degree[v] < groupsize)
+        u, v = u[room], v[room]
+
+    if linked_u:
+        u, v = np.concatenate(linked_u), np.concatenate(linked_v)
+    return ContactGroups.from_edges(size, u, v)
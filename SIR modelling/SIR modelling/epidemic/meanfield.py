@@ -0,0 +1,28 @@
+import numpy as np
+
+
+def meanfield_curves(p_infect, p_death, groupsize, infectious, steps):
+    '''
+    Deterministic mean-field version of the non-spatial EpiDyn, for quick
+    comparison with simulated runs (quarantine groups are not modelled).
+    Every tick a sensitive cell meets `groupsize` random cells: it becomes
+    INFECTIOUS with p_infect * i (the random contact it picks is infectious)
+    and NEIGHBOUR when any other contact is infectious, 1 - (1 - i)^groupsize.
+    :param infectious: initial fraction of INFECTIOUS cells
+    :return: dict with the Infectious, Removed and Exposed fractions per tick,
+             like the DataCollector columns
+    '''
+    i, r, e = float(infectious), 0.0, 0.0
+    curves = np.zeros((steps + 1, 3))
+    curves[0] = i, r, e
+    for t in range(1, steps + 1):
+        s = 1.0 - i - r
+        if groupsize > 0:
+            infected = s * p_infect * i
+            e = s * (1.0 - (1.0 - i) ** groupsize) - infected
+        else:
+            infected = e = 0.0
+        removed = i * p_death
+        i, r = i + infected - removed, r + removed
+        curves[t] = i, r, e
+    return {"Infectious": curves[:, 0], "Removed": curves[:, 1], "Exposed": curves[:, 2]}
@@ -1,9 +1,18 @@
+import random as rd
+
+import numpy as np
 from mesa import Model
 from mesa.datacollection import DataCollector
 from mesa.time import SimultaneousActivation, RandomActivation
 from mesa.space import Grid
 
 from .cell import Cell
+from .engine import GridEngine
+from .groups import form_groups, random_pairs, torus_pairs
+from .neighbourhood import neighbour_index
+from .profiling import NullProfiler, Profiler
+from .storage import RunWriter
+from .strips import StripEngine
 
 
 class EpiDyn(Model):
@@ -13,90 +22,391 @@ class EpiDyn(Model):
     
     schedule_types = {"Random": RandomActivation,
                       "Simultaneous": SimultaneousActivation}
+
+    # "Cell" steps one Mesa agent per grid square, "NumPy" steps the whole
+    # grid at once as an array and "Strips" splits that array over processes
+    engine_types = {"Cell": None,
+                    "NumPy": GridEngine,
+                    "Strips": StripEngine}
+
+    def __new__(cls, *args, **kwargs):
+        # Model.__new__ would make a shared class-level self.random from the
+        # seed; the random generators are made per instance in __init__
+        return object.__new__(cls)
     
-    def __init__(self, height=100, width=100, dummy="", schedule_type="Simultaneous",startblock=1, density=0.1, p_infect=0.25, p_death=0.0, spatial=1, groupsize=4, quarantine_delay=7, neighbourdic={}, groupswitch=True, switchperx=2):
+    # Parameters that fix the layout of the field; reset() rebuilds the
+    # model when one of them changes and reuses it otherwise
+    structure = ("height", "width", "schedule_type", "spatial", "engine", "radius", "moore", "frontier", "strips")
+
+    # Parameters that only concern one run; reset() sets them to these
+    # defaults unless they are given again, so a new run never writes to the
+    # output directory or trace file of the one before
+    run_parameters = {"seed": None, "output": None, "profile": False, "trace": None}
+
+    def __init__(self, height=100, width=100, dummy="", schedule_type="Simultaneous",startblock=1, density=0.1, p_infect=0.25, p_death=0.0, spatial=1, groupsize=4, quarantine_delay=7, groupswitch=True, switchperx=2, engine="Cell", radius=2, moore=True, seed=None, output=None, snapshot_chunk=64, compress=False, profile=False, trace=None, frontier=False, strips=None):
         '''
         Create the CA field with (height, width) cells.
         '''
-        #setting an explicit seed allows you to reproduce interesting runs
-        #self.random.seed(30)
-        
+        self.params = {name: value for name, value in locals().items() if name != "self"}
+
         # Set up the grid and schedule.
         self.schedule_type = schedule_type
         self.schedule = self.schedule_types[self.schedule_type](self)
-        self.neighbourdic = neighbourdic
+        self.spatial = spatial
+        self.engine_type = engine
+        self.radius = radius
+        self.moore = moore
+        # Only step the cells that can change state, see step_frontier()
+        self.frontier = frontier
+        # Number of worker processes of the Strips engine (default: all cores)
+        self.strips = strips
+        if frontier and (engine != "Cell" or schedule_type != "Simultaneous"):
+            raise ValueError("Frontier stepping needs the Cell engine and Simultaneous scheduling")
+        # The torus never changes, so the neighbourhoods are looked up once,
+        # when first needed (see the neighbour_index property)
+        self.torus = (height, width)
+        self._neighbour_index = None
+
+        if self.engine_types[engine] is None:
+            self.engine = None
+            self.place_cells(height, width, spatial)
+        else:
+            if schedule_type != "Simultaneous":
+                raise ValueError("The %s engine only supports Simultaneous scheduling" % engine)
+            # The whole field lives in one array, so no agents or Grid are made
+            self.engine = self.engine_types[engine](self, height, width)
+            self.grid = None
+
+        self.start(**self.params)
+
+    @property
+    def neighbour_index(self):
+        '''
+        The neighbour_index of the torus, or None in the non-spatial setting.
+        Only the Cell engine and von Neumann neighbourhoods read it, so it is
+        built on first use.
+        '''
+        if self._neighbour_index is None and self.spatial:
+            self._neighbour_index = neighbour_index(*self.torus, self.radius, self.moore)
+        return self._neighbour_index
+
+    def start(self, height, width, startblock, density, p_infect, p_death, groupsize, quarantine_delay, groupswitch, switchperx, seed, output, snapshot_chunk, compress, profile, trace, **structure):
+        '''
+        Set the initial state of a run on the field that has been built.
+        '''
+        #setting an explicit seed allows you to reproduce interesting runs;
+        #seed is an int or a SeedSequence (e.g. spawned for one worker of a sweep)
+        #and every random decision of the model is drawn from self.rng
+        if isinstance(seed, np.random.SeedSequence):
+            self.seed_sequence = seed
+        else:
+            self.seed_sequence = np.random.SeedSequence(seed)
+        self.rng = np.random.default_rng(self.seed_sequence)
+        # The Mesa schedulers shuffle with self.random
+        self.random = rd.Random(int(self.seed_sequence.generate_state(1)[0]))
+
+        self.p_infect = p_infect
+        self.p_death = p_death
+        self.groupsize = groupsize
+        # Quarantine groups, formed once quarantine_delay is reached
+        self.groups = None
         self.quarantine_delay = quarantine_delay
         self.groupswitch = groupswitch
         self.switchperx = switchperx
         self.counter = 0
-        
-        # Use a simple grid, where edges wrap around.
-        self.grid = Grid(height, width, torus=True)
+        # Per-phase timings of step(), see profiling.py
+        self.profiler = Profiler(trace) if profile else NullProfiler()
+        self.transitions = 0
+        self.schedule.steps = 0
+        self.schedule.time = 0
         self.datacollector = DataCollector(
             {"Infectious": lambda m: self.count_infectious(m,width*height),
              "Removed": lambda m: self.count_removed(m,width*height),
-             "Exposed": lambda m: self.count_removed(m,width*height)})
+             "Exposed": lambda m: self.count_exposed(m,width*height)})
 
-        # Place a cell at each location, with default SENSTIVE,
-        # and some (a 2x2 block) initialized to INFECTIOUS
-        
-        for (contents, x, y) in self.grid.coord_iter():
-            cell = Cell((x, y), self, spatial, unique_id=int(0.5 * (x + y) * (x + y + 1) + y))
-            cell.state = cell.SENSITIVE
-            cell.p_infect = p_infect
-            cell.p_death = p_death
-            cell.groupsize = groupsize
-            if startblock:
-                if ((x == height/2 or x == height/2+1) and  (y == height/2 or y == height/2+1)):
-                    cell.state = cell.INFECTIOUS
-            elif self.random.random() < density:
-                    cell.state = cell.INFECTIOUS
-            self.grid.place_agent(cell, (x, y))
-            self.schedule.add(cell)
+        # Everybody starts SENSITIVE, and some (a 2x2 block) INFECTIOUS
+        x, y = np.indices((height, width))
+        if startblock:
+            infectious = ((x == height/2) | (x == height/2+1)) & ((y == height/2) | (y == height/2+1))
+        else:
+            infectious = self.rng.random((height, width)) < density
+        self.set_states(np.where(infectious, Cell.INFECTIOUS, Cell.SENSITIVE).astype(np.int8))
+        if self.engine is None:
+            self.cell_p_infect[:] = p_infect
+            self.cell_p_death[:] = p_death
+            self.cell_groupsize[:] = groupsize
 
-        self.measure_CA = []
         self.running = True
         self.datacollector.collect(self)
 
+        # Optionally write every tick to disk, see storage.py
+        self.output = None
+        if output is not None:
+            self.output = RunWriter(output, (height, width), self.datacollector.model_reporters,
+                                    chunk=snapshot_chunk, compress=compress)
+            self.write_output()
+
+    def set_states(self, states):
+        '''
+        Put the given states on the field.
+        :param states: int8 array of shape (height, width), indexed [x, y]
+        '''
+        if self.engine is not None:
+            self.engine.state[...] = states
+        else:
+            self.cell_state[:] = states.ravel()
+            self.cell_next[:] = Cell.NO_STATE
+        # state_counts holds the number of cells in each state (kept up to date
+        # by Cell.advance and the engine)
+        self.state_counts = np.bincount(states.ravel(), minlength=4).tolist()
+        # The INFECTIOUS and NEIGHBOUR cells, for frontier stepping
+        self.infectious_cells = np.flatnonzero(states.ravel() == Cell.INFECTIOUS).astype(np.int32)
+        self.exposed_cells = np.flatnonzero(states.ravel() == Cell.NEIGHBOUR).astype(np.int32)
+
+    def reset(self, **params):
+        '''
+        Start a new run, with the given parameters changed and the others as
+        they were, apart from the run_parameters. The Grid, the cells and all
+        arrays are reused unless one of the structure parameters changes, so
+        back-to-back replicates do not pay for building 10,000+ cells each time.
+        '''
+        self.close()
+        changed = params
+        params = dict(self.params)
+        params.update(self.run_parameters)
+        params.update(changed)
+        if any(params[name] != self.params[name] for name in self.structure):
+            if self.engine is not None:
+                self.engine.stop()
+            self.__init__(**params)
+            return
+        self.params = params
+        self.start(**params)
+
+    def place_cells(self, height, width, spatial):
+        '''
+        Place a Cell agent at every location of a new Grid.
+        '''
+        # Use a simple grid, where edges wrap around.
+        self.grid = Grid(height, width, torus=True)
+
+        # The state, next state and parameters of every cell, in neighbour_index
+        # order; they are set by start()
+        size = height * width
+        self.cell_state = np.zeros(size, dtype=np.int8)
+        self.cell_next = np.full(size, Cell.NO_STATE, dtype=np.int8)
+        self.cell_p_infect = np.zeros(size)
+        self.cell_p_death = np.zeros(size)
+        self.cell_groupsize = np.zeros(size, dtype=np.int16)
+
+        # Place a cell at each location; self.cells holds the cells in
+        # neighbour_index order, every cell is a view of its place in the arrays
+        self.cells = []
+        for (contents, x, y) in self.grid.coord_iter():
+            cell = Cell(self, len(self.cells))
+            self.grid.place_agent(cell, (x, y))
+            self.schedule.add(cell)
+            self.cells.append(cell)
+
     def step(self):
         '''
         Have the scheduler advance each cell by one step
         '''
-        #Need this seperately so the Reset button works fo no group switches
-        if self.counter == 0:
-            self.neighbourdic.clear()
-        
-        if (self.counter - self.quarantine_delay) % self.switchperx == 0:
-            if self.groupswitch == 1:
-                self.neighbourdic.clear()
-        
-        self.measure_CA = [a for a in self.schedule.agents]
-        self.schedule.step()
+        profiler = self.profiler
+        profiler.begin_tick(self.counter)
+
+        # Form new groups when quarantine starts and, with groupswitch,
+        # every switchperx ticks after that
+        if self.counter >= self.quarantine_delay:
+            if self.groupswitch or self.counter == self.quarantine_delay:
+                if (self.counter - self.quarantine_delay) % self.switchperx == 0:
+                    with profiler.phase("groups"):
+                        u, v = self.group_candidates()
+                        self.groups = form_groups(self.grid_size(), u, v, self.groupsize, self.rng)
+                    profiler.count("group_links", len(self.groups.indices) // 2)
+                    profiler.count("grouped_cells", int(np.count_nonzero(self.groups.sizes())))
+
+        self.transitions = 0
+        if self.engine is not None:
+            self.engine.step()
+        elif self.frontier:
+            self.step_frontier()
+        else:
+            with profiler.phase("draws"):
+                self.draw_random_numbers()
+            if self.schedule_type == "Simultaneous":
+                # What SimultaneousActivation.step does, with the two loops timed apart
+                with profiler.phase("step"):
+                    for cell in self.cells:
+                        cell.step()
+                with profiler.phase("advance"):
+                    self.advance_cells()
+                self.schedule.steps += 1
+                self.schedule.time += 1
+            else:
+                with profiler.phase("step"):
+                    self.schedule.step()
+        profiler.count("transitions", self.transitions)
+        # Without INFECTIOUS cells the epidemic is over: nothing changes any more
+        if self.state_counts[Cell.INFECTIOUS] == 0:
+            self.running = False
+
                # collect data
-        self.datacollector.collect(self)
+        with profiler.phase("collect"):
+            self.datacollector.collect(self)
+        if self.output is not None:
+            with profiler.phase("output"):
+                self.write_output()
         
         self.counter = self.counter + 1
+        profiler.end_tick()
+
+    def step_frontier(self):
+        '''
+        Step and advance only the cells on the frontier of the epidemic.
+        A cell without INFECTIOUS contacts that is not INFECTIOUS or NEIGHBOUR
+        itself keeps its state, so the result is that of stepping every cell;
+        only the random numbers are drawn for the frontier alone, so a seed
+        gives a different (equally distributed) run than without frontier.
+        '''
+        profiler = self.profiler
+        with profiler.phase("frontier"):
+            active = self.frontier_cells()
+            self.draw_random_numbers(active)
+        profiler.count("frontier", len(active))
+        cells = [self.cells[i] for i in active.tolist()]
+        with profiler.phase("step"):
+            for cell in cells:
+                cell.step()
+        with profiler.phase("advance"):
+            self.advance_cells(active)
+        self.schedule.steps += 1
+        self.schedule.time += 1
+        # Cells off the frontier cannot have become INFECTIOUS or NEIGHBOUR
+        states = self.cell_state[active]
+        self.infectious_cells = active[states == Cell.INFECTIOUS].astype(np.int32)
+        self.exposed_cells = active[states == Cell.NEIGHBOUR].astype(np.int32)
+
+    def advance_cells(self, active=None):
+        '''
+        What Cell.advance does, for all cells (or the given ids) at once.
+        '''
+        if active is None:
+            changed = self.cell_next != self.cell_state
+            self.transitions += int(np.count_nonzero(changed))
+            self.cell_state[changed] = self.cell_next[changed]
+            self.state_counts = np.bincount(self.cell_state, minlength=4).tolist()
+            return
+        previous = self.cell_state[active]
+        following = self.cell_next[active]
+        changed = following != previous
+        self.transitions += int(np.count_nonzero(changed))
+        self.cell_state[active] = following
+        # Only the changed cells change the counts
+        counts = np.bincount(following[changed], minlength=4) - np.bincount(previous[changed], minlength=4)
+        self.state_counts = [count + change for count, change in zip(self.state_counts, counts.tolist())]
+
+    def frontier_cells(self):
+        '''
+        Sorted ids of the cells that may change state this tick: the INFECTIOUS
+        and NEIGHBOUR cells and every contact of an INFECTIOUS cell. Contacts
+        are symmetric, so these are all cells that can meet an INFECTIOUS one.
+        Without space or groups anybody can be met, so every cell is returned.
+        '''
+        if self.groups is not None:
+            contacts = self.groups.members_of(self.infectious_cells)
+        elif self.spatial:
+            contacts = self.neighbour_index[self.infectious_cells].ravel()
+        else:
+            return np.arange(len(self.cells))
+        return np.unique(np.concatenate([self.infectious_cells, self.exposed_cells, contacts]))
+
+    def draw_random_numbers(self, active=None):
+        '''
+        Draw all random numbers the cells need this tick in bulk; cell i uses
+        draws[i] for infection or removal and picks[i] to pick the contact it
+        meets, and in the non-spatial setting meets the cells in contacts[i].
+        :param active: ids of the cells that are stepped, when not all of them;
+                       draws and picks are then dicts over these ids
+        '''
+        size = len(self.cells)
+        if active is None or len(active) == size:
+            self.draws = self.rng.random(size).tolist()
+            self.picks = self.rng.random(size).tolist()
+        else:
+            ids = active.tolist()
+            self.draws = dict(zip(ids, self.rng.random(len(ids)).tolist()))
+            self.picks = dict(zip(ids, self.rng.random(len(ids)).tolist()))
+        if not self.spatial and self.groups is None:
+            self.contacts = self.rng.integers(0, size, size=(size, self.groupsize))
+
+    def state_grid(self):
+        '''
+        The states of all cells as a uint8 array indexed [x, y].
+        '''
+        if self.engine is not None:
+            return self.engine.state.view(np.uint8)
+        return self.cell_state.view(np.uint8).reshape(self.grid.width, self.grid.height)
+
+    def write_output(self):
+        '''
+        Append the current states and the last collected values to the output.
+        '''
+        row = {name: values[-1] for name, values in self.datacollector.model_vars.items()}
+        self.output.append(self.state_grid(), row)
+
+    def close(self):
+        '''
+        Write the remaining output and the trace of the run, if any.
+        '''
+        if self.output is not None:
+            self.output.close()
+            # The output may be moved away after this (see ResultCache.run),
+            # so a second close() must not write to it again
+            self.output = None
+        self.profiler.close()
+
+    def group_candidates(self):
+        '''
+        The pairs of cells that may be grouped together: spatial neighbours,
+        or in the non-spatial setting random pairs from the population.
+        '''
+        if self.spatial:
+            return torus_pairs(*self.torus, self.radius, self.moore)
+        size = self.grid_size()
+        return random_pairs(size, size * self.groupsize, self.rng)
+
+    def grid_size(self):
+        '''
+        Number of cells in the model.
+        '''
+        if self.engine is not None:
+            return self.engine.size
+        return len(self.cells)
+
+    def count_state(self, state):
+        '''
+        Number of cells currently in the given state.
+        '''
+        return self.state_counts[state]
 
     @staticmethod
     def count_infectious(model,grid_size):
         """
         Helper method to count cells in a given state in a given model.
         """
-        list_state = [a for a in model.schedule.agents if a.state == a.INFECTIOUS]
-        return len(list_state)/grid_size
+        return model.count_state(Cell.INFECTIOUS)/grid_size
 
     @staticmethod
     def count_removed(model,grid_size):
         """
         Helper method to count cells in a given state in a given model.
         """
-        list_state = [a for a in model.schedule.agents if a.state == a.REMOVED]
-        return len(list_state)/grid_size
+        return model.count_state(Cell.REMOVED)/grid_size
 
     @staticmethod
     def count_exposed(model,grid_size):
         """
         Helper method to count cells in a given state in a given model.
         """
-        list_state = [a for a in model.schedule.agents if a.state == a.NEIGHBOUR]
-        return len(list_state)/grid_size
+        return model.count_state(Cell.NEIGHBOUR)/grid_size
@@ -0,0 +1,35 @@
+import numpy as np
+
+
+def neighbourhood_offsets(radius=2, moore=True):
+    '''
+    The (dx, dy) offsets of a neighbourhood, in the same order as
+    Grid.iter_neighborhood returns them (the centre itself not included).
+    '''
+    offsets = []
+    for dy in range(-radius, radius + 1):
+        for dx in range(-radius, radius + 1):
+            if dx == 0 and dy == 0:
+                continue
+            if not moore and abs(dx) + abs(dy) > radius:
+                continue
+            offsets.append((dx, dy))
+    return np.array(offsets, dtype=np.int32).reshape(-1, 2)
+
+
+def neighbour_index(height, width, radius=2, moore=True, cells=None):
+    '''
+    Look-up table of the neighbourhood of every cell on the torus.
+    Cell (x, y) has flat id x * width + y, the order in which
+    Grid.coord_iter visits the cells.
+    :param cells: ids of the cells to look up (default: all cells)
+    :return: (number of cells, k) int32 array, row i holds the ids of the
+             k neighbours of the i-th cell (k = 24 for the radius-2 Moore neighbourhood)
+    '''
+    offsets = neighbourhood_offsets(radius, moore)
+    if cells is None:
+        cells = np.arange(height * width, dtype=np.int32)
+    x, y = np.divmod(np.asarray(cells, dtype=np.int32), width)
+    x = (x[:, None] + offsets[:, 0]) % height
+    y = (y[:, None] + offsets[:, 1]) % width
+    return (x * width + y).astype(np.int32)
@@ -0,0 +1,157 @@
+'''
+The EpiDyn rules on an arbitrary contact network instead of the torus.
+
+    model = NetworkEpidemic.from_networkx(G, p_infect=0.25, p_death=0.07, xi=0.01, seed=1)
+    history = model.run(100)            # uint8 states, shape (101, nodes)
+    Visualizer.showSIRS(G, "run", 0.25, 0.07, 0.01, len(history), model.sirs_data(), states=history)
+
+Every node meets its network neighbours: it is exposed (NEIGHBOUR) when
+one of them is INFECTIOUS and becomes INFECTIOUS with p_infect times the
+share of INFECTIOUS neighbours; INFECTIOUS nodes are REMOVED with p_death
+and, with waning immunity, REMOVED nodes become SENSITIVE again with xi
+(the SIRS model of Visualizer, with beta = p_infect and gamma = p_death).
+The network is kept as a CSR adjacency and every tick is a few array
+operations, so networks of millions of nodes can be simulated.
+'''
+import numpy as np
+
+from .cell import Cell
+from .engine import apply_rules
+from .groups import ContactGroups
+from .storage import RunWriter
+
+
+class NetworkEpidemic:
+    '''
+    Simulates the epidemic on a fixed contact network, all nodes at once.
+    '''
+
+    # The summary columns, as collected by EpiDyn
+    columns = ("Infectious", "Removed", "Exposed")
+
+    def __init__(self, adjacency, p_infect=0.25, p_death=0.0, xi=0.0, infectious=None, density=0.01,
+                 seed=None, output=None, snapshot_chunk=64, compress=False):
+        '''
+        :param adjacency: ContactGroups holding the (symmetric) neighbours of every node
+        :param xi: probability per tick that a REMOVED node becomes SENSITIVE again
+        :param infectious: ids of the initially INFECTIOUS nodes (default: a random
+                           share `density` of all nodes)
+        :param seed: int or SeedSequence
+        :param output: directory to write every tick to, in the format of storage.py
+        '''
+        self.adjacency = adjacency
+        self.size = len(adjacency)
+        self.p_infect = p_infect
+        self.p_death = p_death
+        self.xi = xi
+        if isinstance(seed, np.random.SeedSequence):
+            self.seed_sequence = seed
+        else:
+            self.seed_sequence = np.random.SeedSequence(seed)
+        self.rng = np.random.default_rng(self.seed_sequence)
+        # Number of neighbours of every node, which does not change
+        self.contacts = adjacency.sizes()
+
+        self.state = np.full(self.size, Cell.SENSITIVE, dtype=np.int8)
+        if infectious is None:
+            self.state[self.rng.random(self.size) < density] = Cell.INFECTIOUS
+        else:
+            self.state[np.asarray(infectious)] = Cell.INFECTIOUS
+        self.counter = 0
+        self.state_counts = np.bincount(self.state, minlength=4).tolist()
+        # state_counts of every tick
+        self.counts = [self.state_counts]
+
+        self.output = None
+        if output is not None:
+            self.output = RunWriter(output, (self.size,), self.columns, chunk=snapshot_chunk, compress=compress)
+            self.write_output()
+
+    @classmethod
+    def from_edges(cls, size, u, v, **params):
+        '''
+        Build the model on `size` nodes with undirected edges (u[k], v[k]).
+        '''
+        return cls(ContactGroups.from_edges(size, np.asarray(u, dtype=np.int32), np.asarray(v, dtype=np.int32)),
+                   **params)
+
+    @classmethod
+    def from_networkx(cls, G, **params):
+        '''
+        Build the model on a networkx graph; node i of the model is the i-th
+        node of G, the order in which Visualizer draws them.
+        '''
+        index = {node: i for i, node in enumerate(G)}
+        edges = np.array([(index[a], index[b]) for a, b in G.edges() if a != b], dtype=np.int32).reshape(-1, 2)
+        return cls.from_edges(len(index), edges[:, 0], edges[:, 1], **params)
+
+    def step(self):
+        '''
+        Compute the next state of every node and apply it.
+        '''
+        state = self.state
+        # Exposure only lasts for one tick
+        state[state == Cell.NEIGHBOUR] = Cell.SENSITIVE
+        counts = self.adjacency.count(state == Cell.INFECTIOUS)
+        draws = self.rng.random(self.size)
+        next_state = apply_rules(state, counts, self.contacts, draws, self.p_infect, self.p_death)
+        if self.xi:
+            # A REMOVED node has no other use for its random number
+            next_state[(state == Cell.REMOVED) & (draws < self.xi)] = Cell.SENSITIVE
+        self.state = next_state
+        self.state_counts = np.bincount(next_state, minlength=4).tolist()
+        self.counts.append(self.state_counts)
+        self.counter += 1
+        if self.output is not None:
+            self.write_output()
+
+    def run(self, steps, history=True):
+        '''
+        Run `steps` ticks.
+        :param history: also return the states of every tick
+        :return: uint8 array of shape (steps + 1, nodes), the first row being
+                 the states before the run, or None
+        '''
+        states = np.empty((steps + 1, self.size), dtype=np.uint8) if history else None
+        if history:
+            states[0] = self.state
+        for t in range(1, steps + 1):
+            self.step()
+            if history:
+                states[t] = self.state
+        return states
+
+    def summary(self):
+        '''
+        The Infectious, Removed and Exposed share of the nodes at every tick,
+        like the DataCollector columns of EpiDyn.
+        '''
+        counts = np.array(self.counts, dtype=np.float64) / self.size
+        return {"Infectious": counts[:, Cell.INFECTIOUS],
+                "Removed": counts[:, Cell.REMOVED],
+                "Exposed": counts[:, Cell.NEIGHBOUR]}
+
+    def sirs_data(self):
+        '''
+        The number of S (SENSITIVE or exposed), I and R nodes at every tick,
+        the `data` argument of Visualizer.showSIRS and showData.
+        '''
+        counts = np.array(self.counts)
+        return np.column_stack([counts[:, Cell.SENSITIVE] + counts[:, Cell.NEIGHBOUR],
+                                counts[:, Cell.INFECTIOUS], counts[:, Cell.REMOVED]])
+
+    def write_output(self):
+        '''
+        Append the current states and shares to the output.
+        '''
+        counts = self.state_counts
+        self.output.append(self.state, {"Infectious": counts[Cell.INFECTIOUS] / self.size,
+                                        "Removed": counts[Cell.REMOVED] / self.size,
+                                        "Exposed": counts[Cell.NEIGHBOUR] / self.size})
+
+    def close(self):
+        '''
+        Write the remaining output, if any.
+        '''
+        if self.output is not None:
+            self.output.close()
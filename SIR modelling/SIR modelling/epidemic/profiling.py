@@ -0,0 +1,120 @@
+'''
+Per-tick timers and counters for the phases of EpiDyn.step.
+
+    model = EpiDyn(profile=True, trace="trace.jsonl")
+    ...
+    model.profiler.summary()   # time per phase over the whole run
+    model.profiler.ticks       # one record per tick
+
+With profile=False (the default) the model gets a NullProfiler, whose
+methods do nothing, so the hooks can stay in the hot path.
+'''
+import json
+import time
+
+
+class NullPhase:
+    '''
+    Context manager that does nothing, shared by all disabled phases.
+    '''
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+NULL_PHASE = NullPhase()
+
+
+class NullProfiler:
+    '''
+    Stand-in for Profiler when profiling is off.
+    '''
+
+    enabled = False
+
+    def begin_tick(self, counter):
+        pass
+
+    def phase(self, name):
+        return NULL_PHASE
+
+    def count(self, name, value):
+        pass
+
+    def end_tick(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class Phase:
+    '''
+    Adds the time spent inside the with-block to a phase of the current tick.
+    '''
+
+    def __init__(self, timings, name):
+        self.timings = timings
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        elapsed = time.perf_counter() - self.start
+        self.timings[self.name] = self.timings.get(self.name, 0.0) + elapsed
+        return False
+
+
+class Profiler:
+    '''
+    Collects, for every tick, the time per phase and named counters (such as
+    the number of state transitions or the size of rebuilt groups), and
+    optionally writes every tick as a JSON line to a trace file.
+    '''
+
+    enabled = True
+
+    def __init__(self, trace=None):
+        self.ticks = []
+        self.current = None
+        self.trace = open(trace, "w") if trace is not None else None
+
+    def begin_tick(self, counter):
+        self.current = {"tick": counter, "phases": {}, "counters": {}}
+        self.start = time.perf_counter()
+
+    def phase(self, name):
+        return Phase(self.current["phases"], name)
+
+    def count(self, name, value):
+        self.current["counters"][name] = value
+
+    def end_tick(self):
+        self.current["total"] = time.perf_counter() - self.start
+        self.ticks.append(self.current)
+        if self.trace is not None:
+            self.trace.write(json.dumps(self.current) + "\n")
+        self.current = None
+
+    def summary(self):
+        '''
+        Total and mean time per phase, and its share of all profiled time.
+        :return: dict of phase name -> dict
+        '''
+        totals = {}
+        for tick in self.ticks:
+            for name, elapsed in tick["phases"].items():
+                totals[name] = totals.get(name, 0.0) + elapsed
+        run = sum(tick["total"] for tick in self.ticks) or 1.0
+        return {name: {"total_s": total, "mean_s": total / len(self.ticks), "share": total / run}
+                for name, total in totals.items()}
+
+    def close(self):
+        if self.trace is not None:
+            self.trace.close()
+            self.trace = None
@@ -0,0 +1,160 @@
+'''
+Many replicates of one EpiDyn configuration, simulated together.
+
+    batch = ReplicateBatch(100, height=100, width=100, p_infect=0.25, p_death=0.07, seed=1)
+    series = batch.run(200)             # {"Infectious": (100, 201) array, ...}
+    frames = batch.dataframes()         # one DataCollector-like DataFrame per replicate
+
+The states of all replicates are one (replicates, height, width) int8
+array and every tick applies the rules of the NumPy engine to all of them
+at once, so the Python overhead of a tick is paid once instead of once
+per replicate. Every replicate draws from its own random generator, in
+the same order as EpiDyn(engine="NumPy") does: replicate r is the run of
+EpiDyn(engine="NumPy", seed=batch.seeds[r]) with the same parameters.
+'''
+import numpy as np
+import pandas as pd
+
+from .cell import Cell
+from .engine import apply_rules, count_contacts, reset_exposure
+from .groups import ContactGroups, form_groups, random_pairs, torus_pairs
+from .neighbourhood import neighbour_index
+
+
+class ReplicateBatch:
+    '''
+    Steps `replicates` independent runs of the same parameters as one array
+    (simultaneous updating only, like the NumPy engine).
+    '''
+
+    # The DataCollector columns of EpiDyn and the state each one counts
+    columns = {"Infectious": Cell.INFECTIOUS,
+               "Removed": Cell.REMOVED,
+               "Exposed": Cell.NEIGHBOUR}
+
+    def __init__(self, replicates, height=100, width=100, startblock=1, density=0.1, p_infect=0.25, p_death=0.0,
+                 spatial=1, groupsize=4, quarantine_delay=7, groupswitch=True, switchperx=2, radius=2, moore=True,
+                 seed=None, seeds=None):
+        '''
+        Create `replicates` fields of (height, width) cells; the parameters
+        are those of EpiDyn.
+        :param seed: int or SeedSequence, from which one child SeedSequence
+                     is spawned per replicate
+        :param seeds: the seed of every replicate instead (ints or SeedSequences),
+                      e.g. the seeds a sweep would run one by one
+        '''
+        if seeds is None:
+            if not isinstance(seed, np.random.SeedSequence):
+                seed = np.random.SeedSequence(seed)
+            seeds = seed.spawn(replicates)
+        elif len(seeds) != replicates:
+            raise ValueError("Expected %d seeds, got %d" % (replicates, len(seeds)))
+        self.seeds = [s if isinstance(s, np.random.SeedSequence) else np.random.SeedSequence(s) for s in seeds]
+        self.rngs = [np.random.default_rng(s) for s in self.seeds]
+
+        self.replicates = replicates
+        self.shape = (replicates, height, width)
+        self.size = height * width
+        self.p_infect = p_infect
+        self.p_death = p_death
+        self.spatial = spatial
+        self.groupsize = groupsize
+        self.quarantine_delay = quarantine_delay
+        self.groupswitch = groupswitch
+        self.switchperx = switchperx
+        self.radius = radius
+        self.moore = moore
+        # Only von Neumann neighbourhoods are counted with the neighbour index
+        self.neighbour_index = neighbour_index(height, width, radius, moore) if spatial and not moore else None
+        # The candidate pairs for the groups, which never change on the torus
+        self.pairs = torus_pairs(height, width, radius, moore) if spatial else None
+        # Quarantine groups of all replicates as one ContactGroups (cell i of
+        # replicate r is r * height * width + i), formed once quarantine_delay is reached
+        self.groups = None
+        self.counter = 0
+        # Random numbers of a tick, drawn into the same buffer every tick
+        self.draws = np.empty(self.shape)
+
+        # Everybody starts SENSITIVE, and some (a 2x2 block) INFECTIOUS, as in EpiDyn.start
+        x, y = np.indices((height, width))
+        if startblock:
+            infectious = ((x == height/2) | (x == height/2+1)) & ((y == height/2) | (y == height/2+1))
+            infectious = np.broadcast_to(infectious, self.shape)
+        else:
+            infectious = np.stack([rng.random((height, width)) < density for rng in self.rngs])
+        self.state = np.where(infectious, Cell.INFECTIOUS, Cell.SENSITIVE).astype(np.int8)
+
+        # Number of cells per state of every replicate at every tick
+        self.counts = [self.count_states()]
+
+    def count_states(self):
+        '''
+        Number of cells per state of every replicate, as a (replicates, 4) array.
+        '''
+        # Offset the states of replicate r by 4r, so one bincount counts them all
+        offset = 4 * np.arange(self.replicates, dtype=np.int64)[:, None, None]
+        return np.bincount((self.state + offset).ravel(), minlength=4 * self.replicates).reshape(-1, 4)
+
+    def step(self):
+        '''
+        Compute the next state of every cell of every replicate and apply it.
+        '''
+        state = self.state
+
+        # Form new groups when quarantine starts and, with groupswitch,
+        # every switchperx ticks after that; every replicate has its own
+        if self.counter >= self.quarantine_delay:
+            if self.groupswitch or self.counter == self.quarantine_delay:
+                if (self.counter - self.quarantine_delay) % self.switchperx == 0:
+                    self.groups = self.form_groups()
+
+        reset_exposure(state)
+        # Count the INFECTIOUS contacts of every cell, as GridEngine.step does
+        counts, contacts = count_contacts(state, self.shape, self.groups, self.spatial, self.radius, self.moore,
+                                          self.neighbour_index, self.groupsize, self.rngs)
+
+        for rng, draws in zip(self.rngs, self.draws):
+            rng.random(out=draws)
+        self.state = apply_rules(state, counts, contacts, self.draws, self.p_infect, self.p_death)
+        self.counts.append(self.count_states())
+        self.counter += 1
+
+    def form_groups(self):
+        '''
+        New quarantine groups for all replicates, every replicate drawing
+        from its own generator as EpiDyn.step does.
+        '''
+        groups = []
+        for rng in self.rngs:
+            if self.spatial:
+                u, v = self.pairs
+            else:
+                u, v = random_pairs(self.size, self.size * self.groupsize, rng)
+            groups.append(form_groups(self.size, u, v, self.groupsize, rng))
+        return ContactGroups.concatenate(groups)
+
+    def run(self, steps):
+        '''
+        Run `steps` ticks.
+        :return: the series of all ticks so far, see series()
+        '''
+        for _ in range(steps):
+            self.step()
+        return self.series()
+
+    def series(self):
+        '''
+        The Infectious, Removed and Exposed share of the cells of every
+        replicate at every tick, like the DataCollector columns of EpiDyn.
+        :return: dict of column name -> (replicates, ticks + 1) array
+        '''
+        counts = np.stack(self.counts, axis=1) / self.size
+        return {name: counts[:, :, state] for name, state in self.columns.items()}
+
+    def dataframes(self):
+        '''
+        The series of every replicate as the DataFrame that
+        datacollector.get_model_vars_dataframe() gives for a single run.
+        '''
+        series = self.series()
+        return [pd.DataFrame({name: values[r] for name, values in series.items()}) for r in range(self.replicates)]
@@ -1,9 +1,10 @@
-from mesa.visualization.modules import CanvasGrid, ChartModule
+from mesa.visualization.modules import ChartModule
 from mesa.visualization.ModularVisualization import ModularServer
 from mesa.visualization.UserParam import UserSettableParameter
 
 
 from .model import EpiDyn
+from .stategrid import StateGrid
 
 COLORS = ['White', 'Red', 'Blue', 'Yellow']
 
@@ -20,8 +21,10 @@ def portrayCell(cell):
     portrayal["Color"] = COLORS[cell.state]
     return portrayal
 
-# Make a world that is 100x100, on a 500x500 display.
-canvas_element = CanvasGrid(portrayCell, 100, 100, 500, 500)
+# Make a world that is 100x100, on a 500x500 display. StateGrid only sends the
+# cells that changed each tick; CanvasGrid(portrayCell, 100, 100, 500, 500)
+# draws the same with a portrayal per cell
+canvas_element = StateGrid(COLORS, 100, 100, 500, 500)
 cell_chart = ChartModule([{"Label": "Infectious", "Color": 'Red'},
                           {"Label": "Removed", "Color": 'Blue'}],
                          canvas_height=500, canvas_width=1000)
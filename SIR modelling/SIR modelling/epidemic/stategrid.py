@@ -0,0 +1,61 @@
+import base64
+import json
+import os
+
+import numpy as np
+from mesa.visualization.ModularVisualization import VisualizationElement
+
+
+def pack(array):
+    '''
+    Base64 text of the bytes of an array, to send it inside a JSON message.
+    '''
+    return base64.b64encode(np.ascontiguousarray(array).tobytes()).decode("ascii")
+
+
+class StateGrid(VisualizationElement):
+    '''
+    Draws the states of all cells like a CanvasGrid with one filled square
+    per cell, but without a portrayal per cell: the browser paints every
+    state in its colour from `colors`, and after the first frame only the
+    cells that changed state are sent (or the whole grid, as one uint8
+    buffer, when most cells changed). The model only needs state_grid().
+    The cells last sent are kept here, so one browser at a time is served.
+    '''
+
+    # The browser side, see StateGridModule.js
+    with open(os.path.join(os.path.dirname(__file__), "StateGridModule.js")) as f:
+        module_code = f.read()
+
+    def __init__(self, colors, grid_width, grid_height, canvas_width=500, canvas_height=500):
+        '''
+        :param colors: HTML colour of every state, indexed by state
+        :param grid_width, grid_height: size of the grid, in cells
+        :param canvas_width, canvas_height: size of the canvas, in pixels
+        '''
+        self.grid_width = grid_width
+        self.grid_height = grid_height
+        new_element = "new StateGridModule({}, {}, {}, {}, {})".format(
+            canvas_width, canvas_height, grid_width, grid_height, json.dumps(list(colors)))
+        self.js_code = self.module_code + "\nelements.push(" + new_element + ");"
+        self.last = None
+        self.last_model = None
+        self.last_tick = None
+
+    def render(self, model):
+        states = model.state_grid().ravel()
+        # A frame continues the last one when it is the next tick of the same model
+        follows = (self.last is not None and model is self.last_model
+                   and model.counter == self.last_tick + 1)
+        message = None
+        if follows:
+            cells = np.flatnonzero(states != self.last)
+            # 4 bytes for the id and 1 for the state of every changed cell
+            if 5 * len(cells) < len(states):
+                message = {"full": False, "cells": pack(cells.astype("<u4")), "states": pack(states[cells])}
+        if message is None:
+            message = {"full": True, "states": pack(states)}
+        self.last = states.copy()
+        self.last_model = model
+        self.last_tick = model.counter
+        return message
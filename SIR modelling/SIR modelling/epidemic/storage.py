@@ -0,0 +1,157 @@
+'''
+On-disk format for the output of a run, written while the model runs:
+
+    <path>/meta.json                    shape, chunk length, columns, number of ticks
+    <path>/summary/<column>.npy         one float64 array per DataCollector column
+    <path>/snapshots/chunk_000000.npy   uint8 states of `chunk` ticks, (chunk, height, width)
+                                        (.npz with array "states" when compressed)
+
+Uncompressed chunks are memory-mapped by RunReader, so a single tick or the
+history of a single cell can be read without loading the whole run. A run
+written with snapshots=False only has the summary.
+'''
+import json
+import os
+
+import numpy as np
+
+
+class RunWriter:
+    '''
+    Appends the state grid and the summary row of every tick to a run directory.
+    '''
+
+    def __init__(self, path, shape, columns, chunk=64, compress=False, snapshots=True):
+        '''
+        :param shape: (height, width) of the state grid
+        :param columns: names of the summary columns
+        :param chunk: number of ticks per snapshot file
+        :param compress: write compressed .npz chunks instead of .npy
+        :param snapshots: write the state grids (or only the summary)
+        '''
+        self.path = path
+        self.shape = tuple(shape)
+        self.columns = list(columns)
+        self.chunk = chunk
+        self.compress = compress
+        self.snapshots = snapshots
+        self.ticks = 0
+        self.written = 0
+        self.summary = {name: [] for name in self.columns}
+        if snapshots:
+            self.buffer = np.empty((chunk,) + self.shape, dtype=np.uint8)
+            os.makedirs(os.path.join(path, "snapshots"), exist_ok=True)
+        os.makedirs(os.path.join(path, "summary"), exist_ok=True)
+
+    def append(self, states, row):
+        '''
+        Add one tick.
+        :param states: state grid of shape `shape` (ignored without snapshots)
+        :param row: dict of column name -> value
+        '''
+        if self.snapshots:
+            self.buffer[self.ticks % self.chunk] = states
+        for name in self.columns:
+            self.summary[name].append(row[name])
+        self.ticks += 1
+        if self.ticks % self.chunk == 0:
+            self.flush()
+
+    def flush(self):
+        '''
+        Write the buffered ticks, the summary columns and the metadata.
+        '''
+        if self.snapshots and self.ticks > self.written:
+            start = (self.ticks - 1) // self.chunk * self.chunk
+            name = os.path.join(self.path, "snapshots", "chunk_%06d" % (start // self.chunk))
+            if self.compress:
+                np.savez_compressed(name + ".npz", states=self.buffer[:self.ticks - start])
+            else:
+                np.save(name + ".npy", self.buffer[:self.ticks - start])
+            self.written = self.ticks
+        for column in self.columns:
+            np.save(os.path.join(self.path, "summary", column + ".npy"), np.array(self.summary[column], dtype=np.float64))
+        meta = {"shape": self.shape, "chunk": self.chunk, "compress": self.compress,
+                "snapshots": self.snapshots, "columns": self.columns, "ticks": self.ticks}
+        with open(os.path.join(self.path, "meta.json"), "w") as f:
+            json.dump(meta, f)
+
+    def close(self):
+        '''
+        Write what is left; the run can be read with RunReader afterwards.
+        '''
+        self.flush()
+
+
+class RunReader:
+    '''
+    Reads a run directory written by RunWriter.
+    '''
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, "meta.json")) as f:
+            meta = json.load(f)
+        self.shape = tuple(meta["shape"])
+        self.chunk = meta["chunk"]
+        self.compress = meta["compress"]
+        self.snapshots = meta.get("snapshots", True)
+        self.columns = meta["columns"]
+        self.ticks = meta["ticks"]
+        # The summary table, once loaded
+        self._summary = None
+
+    def __len__(self):
+        return self.ticks
+
+    def __getitem__(self, t):
+        '''
+        State grid at tick t, so a reader can stand in for an array of all
+        ticks (e.g. the states of Visualizer.showSIRS).
+        '''
+        return self.tick(t)
+
+    def _chunk(self, number):
+        '''
+        The states of one chunk, memory-mapped when possible.
+        '''
+        if not self.snapshots:
+            raise ValueError("%s was written without snapshots" % self.path)
+        name = os.path.join(self.path, "snapshots", "chunk_%06d" % number)
+        if self.compress:
+            with np.load(name + ".npz") as data:
+                return data["states"]
+        return np.load(name + ".npy", mmap_mode="r")
+
+    def tick(self, t):
+        '''
+        State grid at tick t, shape (height, width).
+        '''
+        if not 0 <= t < self.ticks:
+            raise IndexError("tick %d out of range (%d ticks)" % (t, self.ticks))
+        return self._chunk(t // self.chunk)[t % self.chunk]
+
+    def cell(self, x, y):
+        '''
+        State of cell (x, y) at every tick.
+        '''
+        chunks = (self.ticks + self.chunk - 1) // self.chunk
+        return np.concatenate([np.array(self._chunk(n)[:, x, y]) for n in range(chunks)])
+
+    def states(self):
+        '''
+        All state grids, shape (ticks, height, width); this loads the whole run.
+        '''
+        chunks = (self.ticks + self.chunk - 1) // self.chunk
+        return np.concatenate([np.array(self._chunk(n)) for n in range(chunks)])
+
+    def summary(self):
+        '''
+        The summary table as a dict of column name -> array. It is read into
+        memory on the first call, so it stays available when the run
+        directory is removed later on.
+        '''
+        if self._summary is None:
+            self._summary = {name: np.load(os.path.join(self.path, "summary", name + ".npy"))
+                             for name in self.columns}
+        return self._summary
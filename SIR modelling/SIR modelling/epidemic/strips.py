@@ -0,0 +1,216 @@
+'''
+Domain-decomposed stepping of the whole field over worker processes.
+
+The torus is split into horizontal strips of rows (x), one per worker
+process. The states live in two shared-memory arrays: every tick each worker
+reads its strip plus `radius` halo rows on either side (wrapping around the
+torus) from the current array and writes the next states of its own strip
+to the other one. The model waits for all strips before the arrays swap, so
+updating stays simultaneous.
+
+    model = EpiDyn(height=5000, width=5000, engine="Strips", strips=8)
+'''
+import multiprocessing
+import os
+from multiprocessing import shared_memory, util
+
+import numpy as np
+
+from .cell import Cell
+from .engine import apply_rules, count_contacts, reset_exposure
+from .groups import ContactGroups
+from .neighbourhood import neighbour_index
+
+
+def strip_worker(connection, name, shape, start, stop, radius, moore):
+    '''
+    Step rows start..stop-1 of the field on every "step" command.
+    :param connection: Pipe to the StripEngine
+    :param name: name of the shared memory holding both state arrays
+    '''
+    memory = shared_memory.SharedMemory(name=name)
+    buffers = np.ndarray((2,) + tuple(shape), dtype=np.int8, buffer=memory.buf)
+    height, width = shape
+    cells = np.arange(start * width, stop * width, dtype=np.int32)
+    # The strip with its halo rows, wrapping around the torus
+    rows = np.arange(start - radius, stop + radius) % height
+    index = None if moore else neighbour_index(height, width, radius, moore, cells)
+    groups = None
+    rng = None
+    field = None
+
+    while True:
+        command, *args = connection.recv()
+        if command == "stop":
+            break
+        if command == "seed":
+            rng = np.random.default_rng(args[0])
+        elif command == "get_rng":
+            connection.send(rng.bit_generator.state)
+        elif command == "set_rng":
+            rng = np.random.default_rng()
+            rng.bit_generator.state = args[0]
+        elif command == "groups":
+            groups = ContactGroups(*args[0]) if args[0] is not None else None
+        elif command == "step":
+            current, p_infect, p_death, groupsize, spatial = args
+            field = buffers[current]
+            state = field[start:stop].copy()
+            reset_exposure(state)
+            # Only the contacts of the strip's own cells are read from the field
+            counts, contacts = count_contacts(field, state.shape, groups, spatial, radius, moore, index, groupsize,
+                                              [rng], rows)
+
+            draws = rng.random(state.shape)
+            next_state = apply_rules(state, counts, contacts, draws, p_infect, p_death)
+            buffers[1 - current, start:stop] = next_state
+            connection.send((np.bincount(next_state.ravel(), minlength=4),
+                             int(np.count_nonzero(next_state != state))))
+
+    # The shared memory can only be closed once no array uses it
+    field = buffers = None
+    memory.close()
+
+
+def stop_workers(connections, processes, memory):
+    '''
+    Stop the worker processes and free the shared memory.
+    '''
+    for connection in connections:
+        try:
+            connection.send(("stop",))
+        except (BrokenPipeError, OSError):
+            pass
+    for process in processes:
+        process.join()
+    for connection in connections:
+        connection.close()
+    memory.close()
+    memory.unlink()
+
+
+class StripEngine:
+    '''
+    Applies the Cell transition rules like GridEngine, with the rows of the
+    field split over `model.strips` worker processes (default: all cores).
+    Every strip draws from its own random generator, so a seed gives a
+    different run for a different number of strips.
+    '''
+
+    def __init__(self, model, height, width):
+        '''
+        Create an all-SENSITIVE field of (height, width) cells in shared
+        memory and start one worker per strip.
+        '''
+        self.model = model
+        self.shape = (height, width)
+        self.size = height * width
+        self.memory = shared_memory.SharedMemory(create=True, size=2 * self.size)
+        self.buffers = np.ndarray((2,) + self.shape, dtype=np.int8, buffer=self.memory.buf)
+        self.buffers[...] = Cell.SENSITIVE
+        self.current = 0
+
+        strips = min(model.strips or os.cpu_count(), height)
+        bounds = np.linspace(0, height, strips + 1).astype(int).tolist()
+        self.strips = list(zip(bounds[:-1], bounds[1:]))
+        context = multiprocessing.get_context()
+        self.connections = []
+        self.processes = []
+        for start, stop in self.strips:
+            parent, child = context.Pipe()
+            process = context.Process(target=strip_worker, daemon=True,
+                                      args=(child, self.memory.name, self.shape, start, stop, model.radius, model.moore))
+            process.start()
+            child.close()
+            self.connections.append(parent)
+            self.processes.append(process)
+        # The groups and seed the workers were last sent
+        self.groups = None
+        self.seed_sequence = None
+        # Stop the workers when the engine is collected, and at the latest when
+        # the process exits: a multiprocessing finalizer also runs at the exit
+        # of a pool worker (e.g. of a sweep) holding the engine, where atexit
+        # handlers do not
+        self.finalizer = util.Finalize(self, stop_workers, args=(self.connections, self.processes, self.memory),
+                                       exitpriority=10)
+
+    @property
+    def state(self):
+        '''
+        The current states, indexed [x, y].
+        '''
+        return self.buffers[self.current]
+
+    def count_states(self):
+        '''
+        Number of cells per state, indexed by state.
+        '''
+        return np.bincount(self.state.ravel(), minlength=4).tolist()
+
+    def send_seeds(self):
+        '''
+        Give every strip its own generator, a child of the model's seed.
+        '''
+        sequence = self.model.seed_sequence
+        for number, connection in enumerate(self.connections):
+            child = np.random.SeedSequence(sequence.entropy, spawn_key=sequence.spawn_key + (number,))
+            connection.send(("seed", child))
+        self.seed_sequence = sequence
+
+    def rng_states(self):
+        '''
+        The state of the generator of every strip, or None before the first
+        tick of a run (when the strips have not been seeded yet).
+        '''
+        if self.seed_sequence is not self.model.seed_sequence:
+            return None
+        for connection in self.connections:
+            connection.send(("get_rng",))
+        return [connection.recv() for connection in self.connections]
+
+    def set_rng_states(self, states):
+        '''
+        Continue every strip from a generator state saved by rng_states().
+        '''
+        for connection, state in zip(self.connections, states):
+            connection.send(("set_rng", state))
+        self.seed_sequence = self.model.seed_sequence
+
+    def send_groups(self):
+        '''
+        Send every strip the rows of the quarantine groups of its own cells.
+        '''
+        groups = self.model.groups
+        width = self.shape[1]
+        for (start, stop), connection in zip(self.strips, self.connections):
+            if groups is None:
+                connection.send(("groups", None))
+                continue
+            first, last = groups.indptr[start * width], groups.indptr[stop * width]
+            indptr = groups.indptr[start * width:stop * width + 1] - first
+            connection.send(("groups", (indptr, groups.indices[first:last])))
+        self.groups = groups
+
+    def step(self):
+        '''
+        Have every strip compute its next states and swap the arrays.
+        '''
+        model = self.model
+        if model.counter == 0 or model.seed_sequence is not self.seed_sequence:
+            self.send_seeds()
+        if model.groups is not self.groups:
+            self.send_groups()
+
+        with model.profiler.phase("strips"):
+            for connection in self.connections:
+                connection.send(("step", self.current, model.p_infect, model.p_death, model.groupsize, model.spatial))
+            replies = [connection.recv() for connection in self.connections]
+        self.current = 1 - self.current
+        model.state_counts = np.sum([counts for counts, _ in replies], axis=0).tolist()
+        model.transitions = sum(transitions for _, transitions in replies)
+
+    def stop(self):
+        '''
+        Stop the worker processes and free the shared memory.
+        '''
+        self.finalizer()
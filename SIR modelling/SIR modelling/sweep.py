@@ -0,0 +1,5 @@
+from epidemic.batch import main
+
+# The guard keeps worker processes from starting sweeps of their own
+if __name__ == "__main__":
+    main()
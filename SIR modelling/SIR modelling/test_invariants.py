@@ -0,0 +1,80 @@
+'''
+Invariants of the epidemic package, on tiny grids and few ticks.
+
+    python -m pytest test_invariants.py
+'''
+import numpy as np
+import pytest
+
+from epidemic.cell import Cell
+from epidemic.checkpoint import load_checkpoint, save_checkpoint
+from epidemic.model import EpiDyn
+from epidemic.replicates import ReplicateBatch
+
+# A quarantine that starts, and groups that switch, within the few ticks
+PARAMS = dict(height=20, width=20, p_death=0.07, quarantine_delay=4, switchperx=3)
+
+CONFIGURATIONS = [dict(),
+                  dict(schedule_type="Random"),
+                  dict(frontier=True),
+                  dict(spatial=0),
+                  dict(moore=False),
+                  dict(engine="NumPy"),
+                  dict(engine="NumPy", spatial=0),
+                  dict(engine="NumPy", startblock=0, density=0.03)]
+
+
+def run(model, ticks):
+    for _ in range(ticks):
+        model.step()
+    return model
+
+
+@pytest.mark.parametrize("params", CONFIGURATIONS)
+def test_checkpoint_resumes_bit_identically(params, tmp_path):
+    path = str(tmp_path / "checkpoint.npz")
+    model = run(EpiDyn(seed=5, **dict(PARAMS, **params)), 6)
+    save_checkpoint(model, path)
+    run(model, 8)
+    resumed = run(load_checkpoint(path), 8)
+    assert np.array_equal(resumed.state_grid(), model.state_grid())
+    assert resumed.datacollector.model_vars == model.datacollector.model_vars
+
+
+@pytest.mark.parametrize("params", [dict(), dict(spatial=0), dict(moore=False), dict(groupswitch=False),
+                                    dict(startblock=0, density=0.03)])
+def test_replicate_equals_numpy_run(params):
+    seeds = [1, 2, 3]
+    batch = ReplicateBatch(len(seeds), seeds=seeds, **dict(PARAMS, **params))
+    series = batch.run(12)
+    for r, seed in enumerate(seeds):
+        model = run(EpiDyn(engine="NumPy", seed=seed, **dict(PARAMS, **params)), 12)
+        assert np.array_equal(batch.state[r].view(np.uint8), model.state_grid())
+        for name, values in model.datacollector.model_vars.items():
+            assert np.allclose(series[name][r], values)
+
+
+@pytest.mark.parametrize("params", CONFIGURATIONS)
+def test_state_counts_match_grid(params):
+    model = EpiDyn(seed=3, **dict(PARAMS, **params))
+    for _ in range(10):
+        model.step()
+        counts = np.bincount(model.state_grid().ravel(), minlength=4)
+        assert list(model.state_counts) == counts.tolist()
+
+
+def test_cell_and_numpy_engines_agree_in_distribution():
+    '''
+    The engines draw their random numbers differently, so only the
+    distribution of the runs can agree: the mean share of cells ever
+    infected after some ticks must be within the sampling error.
+    '''
+    ticks = 10
+    shares = {}
+    for engine in ("Cell", "NumPy"):
+        runs = [run(EpiDyn(engine=engine, seed=seed, p_infect=0.5, **PARAMS), ticks) for seed in range(40)]
+        infected = (Cell.INFECTIOUS, Cell.REMOVED)
+        shares[engine] = np.array([np.isin(model.state_grid(), infected).mean() for model in runs])
+    difference = shares["Cell"].mean() - shares["NumPy"].mean()
+    error = np.sqrt(sum(share.var(ddof=1) / len(share) for share in shares.values()))
+    assert abs(difference) < 4 * error
@@ -1,12 +1,228 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
+import hashlib
+import json
+import os
+
 import plotly.graph_objects as go
 import plotly
 import networkx as nx
 
 import numpy as np
 
+#colours of the states: S (0) blue, I (1) red, R (2) green. The node colours are stored as these
+#integers and mapped to colours by plotly, which is much smaller than a colour string per node
+STATE_COLORSCALE=[[0,'blue'],[0.5,'red'],[1,'green']]
+
+#directory in which computed layouts are kept, so the same contact graph is laid out only once
+LAYOUT_CACHE='.layout_cache'
+
+#This function returns the edges of G as an (E,2) array of node numbers, in the order of the nodes of G
+def edgeArray(G):
+    index={n:i for i,n in enumerate(G)}
+    return np.array([(index[u],index[v]) for u,v in G.edges()], dtype=np.int64).reshape(-1,2)
+
+#This function returns a fingerprint of the nodes and edges of G (not of their attributes, such as the states)
+def graphFingerprint(G):
+    digest=hashlib.sha256()
+    digest.update(json.dumps([repr(n) for n in G]).encode())
+    digest.update(edgeArray(G).tobytes())
+    return digest.hexdigest()
+
+#This function returns True when the nodes of G are (x, y) grid coordinates, as for the EpiDyn torus or nx.grid_2d_graph
+def isGrid(G):
+    return all(isinstance(n,tuple) and len(n)==2 and all(isinstance(c,(int,np.integer)) for c in n) for n in G)
+
+#(dx, dy) offsets of the cells of a grid around a node: the 6x6 children of the 3x3 cells around the parent of the
+#node's cell (from the even cell before it), and the 3x3 cells around its own cell
+FAR_OFFSETS=np.array([(dx,dy) for dx in range(-2,4) for dy in range(-2,4)])
+NEAR_OFFSETS=np.array([(dx,dy) for dx in (-1,0,1) for dy in (-1,0,1)])
+
+#This function adds to displacement[i] the Fruchterman-Reingold repulsion k^2*mass/d of nodes of the given mass at
+#the given positions, d being their distance to the nodes i
+def addRepulsion(displacement,positions,i,others,mass,k):
+    delta=positions[i]-others
+    distance2=np.maximum((delta**2).sum(axis=1),(0.01*k)**2)
+    force=delta*(k*k*mass/distance2)[:,None]
+    for d in range(2):
+        displacement[:,d]+=np.bincount(i,weights=force[:,d],minlength=len(displacement))
+
+#This function lays out G with the Fruchterman-Reingold algorithm and returns an (nodes,2) array, approximating the
+#repulsion between distant nodes as Barnes-Hut does: the nodes are sorted into grids of 4x4, 8x8, 16x16, ... cells and a
+#node is pushed away by the centre of mass of every cell that is far from its own cell but whose parent cell is not;
+#only the nodes in the cells neighbouring its own cell in the finest grid push it away one by one. An iteration thus
+#takes time linear in the number of edges and n*log(n) in the number of nodes, and no scipy is needed.
+def gridSpringLayout(G,iterations=50,seed=None):
+    n=G.number_of_nodes()
+    rng=np.random.default_rng(seed)
+    positions=rng.random((n,2))
+    if n<2:
+        return positions
+    edges=edgeArray(G)
+    edges=edges[edges[:,0]!=edges[:,1]]
+    #the ideal edge length when the nodes share the unit square, as in nx.spring_layout
+    k=1/np.sqrt(n)
+    temperature=0.1
+    for _ in range(iterations):
+        displacement=np.zeros((n,2))
+        #attraction d^2/k along the edges
+        delta=positions[edges[:,0]]-positions[edges[:,1]]
+        force=delta*(np.linalg.norm(delta,axis=1)/k)[:,None]
+        for d in range(2):
+            displacement[:,d]-=np.bincount(edges[:,0],weights=force[:,d],minlength=n)
+            displacement[:,d]+=np.bincount(edges[:,1],weights=force[:,d],minlength=n)
+        lowest=positions.min(axis=0)
+        extent=max((positions.max(axis=0)-lowest).max(),1e-12)
+        #the cells of the finest grid are about 2k wide, so they hold a few nodes each, but there are at most
+        #about 4n of them when some nodes are far away
+        levels=max(min(int(np.ceil(np.log2(extent/(2*k)))),int(np.ceil(np.log2(n)/2))+1),2)
+        for level in range(2,levels+1):
+            size=2**level
+            cx,cy=np.minimum(((positions-lowest)/extent*size).astype(np.int64),size-1).T
+            cell=cx*size+cy
+            counts=np.bincount(cell,minlength=size*size)
+            centres=np.stack([np.bincount(cell,weights=positions[:,d],minlength=size*size) for d in range(2)],axis=1)
+            centres/=np.maximum(counts,1)[:,None]
+            #the children of the cells neighbouring the parent of the node's cell, which do not neighbour its cell
+            tx=(cx-cx%2)[:,None]+FAR_OFFSETS[:,0]
+            ty=(cy-cy%2)[:,None]+FAR_OFFSETS[:,1]
+            far=((np.abs(tx-cx[:,None])>1)|(np.abs(ty-cy[:,None])>1))&(tx>=0)&(tx<size)&(ty>=0)&(ty<size)
+            i,offset=np.nonzero(far)
+            target=tx[i,offset]*size+ty[i,offset]
+            full=counts[target]>0
+            i,target=i[full],target[full]
+            addRepulsion(displacement,positions,i,centres[target],counts[target],k)
+        #the nodes in the same or a neighbouring cell of the finest grid, one by one
+        order=np.argsort(cell,kind='stable')
+        starts=np.cumsum(counts)-counts
+        tx=cx[:,None]+NEAR_OFFSETS[:,0]
+        ty=cy[:,None]+NEAR_OFFSETS[:,1]
+        i,offset=np.nonzero((tx>=0)&(tx<size)&(ty>=0)&(ty<size))
+        target=tx[i,offset]*size+ty[i,offset]
+        lengths=counts[target]
+        i=np.repeat(i,lengths)
+        j=order[np.repeat(starts[target]-np.cumsum(lengths)+lengths,lengths)+np.arange(lengths.sum())]
+        i,j=i[i!=j],j[i!=j]
+        addRepulsion(displacement,positions,i,positions[j],1,k)
+        #move at most the temperature, which cools down linearly
+        length=np.maximum(np.linalg.norm(displacement,axis=1),1e-12)
+        positions+=displacement*(np.minimum(length,temperature)/length)[:,None]
+        temperature-=0.1/(iterations+1)
+    return positions
+
+#This function computes the layout of G as an (nodes,2) array, with method:
+#-'grid': the nodes are (x, y) coordinates and are drawn there, no layout has to be computed.
+#-'spring': nx.spring_layout with the given number of iterations.
+#-'fast': gridSpringLayout with at most 50 iterations, which takes n*log(n) instead of quadratic time per iteration.
+#-'auto': 'grid' when possible, 'spring' for small graphs and 'fast' for graphs of 5000 nodes or more.
+def computeLayout(G,method='auto',iterations=600):
+    if method=='auto':
+        method='grid' if isGrid(G) else 'spring' if G.number_of_nodes()<5000 else 'fast'
+    if method=='grid':
+        return np.array(list(G), dtype=np.float64)
+    if method=='fast':
+        #scaled like the positions of nx.spring_layout
+        return nx.rescale_layout(gridSpringLayout(G,min(iterations,50)))
+    positions=nx.spring_layout(G, iterations=iterations)# iterations may slow the algorithm quite a bit
+    return np.array([positions[n] for n in G], dtype=np.float64)
+
+#This function returns graphFingerprint(G), which is computed once per graph and kept in G.graph with the number of
+#nodes and edges; after rewiring G in place without changing these, delete G.graph['fingerprint'].
+def cachedFingerprint(G):
+    counts=(G.number_of_nodes(),G.number_of_edges())
+    cached=G.graph.get('fingerprint')
+    if cached is None or cached[0]!=counts:
+        cached=(counts,graphFingerprint(G))
+        G.graph['fingerprint']=cached
+    return cached[1]
+
+#This function returns the positions of the nodes of G. A layout is computed once per graph: it is kept in G.graph
+#and on disk in the directory `cache` (None to not use the disk), under the fingerprint of the graph, so it is
+#reused for other runs and parameters on the same contact graph. See computeLayout for method and iterations.
+def nodePositions(G,iterations=600,method='auto',cache=LAYOUT_CACHE):
+    #the layout kept in G.graph is only reused for the same nodes and edges (see cachedFingerprint)
+    fingerprint=cachedFingerprint(G)
+    key=(fingerprint,method,iterations)
+    cached=G.graph.get('layout')
+    if cached is not None and cached[0]==key:
+        return cached[1]
+    filename=None
+    if cache is not None:
+        filename=os.path.join(cache,'%s_%s_%d.npy' % (fingerprint,method,iterations))
+    if filename is not None and os.path.exists(filename):
+        coords=np.load(filename)
+        print("Nodes positions loaded.")
+    else:
+        coords=computeLayout(G,method,iterations)
+        if filename is not None:
+            os.makedirs(cache, exist_ok=True)
+            #written under another name first, so another process never reads half a file
+            temporary='%s.%d.npy' % (filename[:-4],os.getpid())
+            np.save(temporary,coords)
+            os.replace(temporary,filename)
+        print("Nodes positions computed.")
+    positions=dict(zip(G,coords))
+    G.graph['layout']=(key,positions)
+    return positions
+
+#This function returns the positions as an (nodes,2) array, in the order of the nodes of G
+def positionArray(G,positions):
+    return np.array([positions[n] for n in G], dtype=np.float64).reshape(-1,2)
+
+#This function returns the trace of all edges, which does not change from frame to frame. The coordinates
+#are built as arrays: for every edge its two ends followed by a NaN, which breaks the line
+def edgeTrace(G,positions):
+    coords=positionArray(G,positions)
+    edges=edgeArray(G)
+    segments=np.full((len(edges),3,2),np.nan)
+    segments[:,0]=coords[edges[:,0]]
+    segments[:,1]=coords[edges[:,1]]
+    
+    edge_trace = go.Scatter(
+            x=segments[:,:,0].ravel(), y=segments[:,:,1].ravel(),
+            line=dict(width=1, color='#888'),
+                      hoverinfo='none',
+                      mode='lines')
+    print("Edges trace computed.")
+    return edge_trace
+
+#This function returns the states of all nodes at time t as a uint8 array, in the order of the nodes of G.
+#They are read from the 'state' lists of the nodes or, when given, from `states`: an array of shape
+#(nb_frames, nodes) such as the history of a NetworkEpidemic or a RunReader of its output. Exposed nodes
+#(state 3 in those histories) are shown as S.
+def nodeStates(G,t,states=None):
+    if states is not None:
+        current=np.asarray(states[t], dtype=np.uint8)
+        return np.where(current==3,0,current).astype(np.uint8)
+    return np.fromiter((G.nodes[n]['state'][t] for n in G), dtype=np.uint8, count=G.number_of_nodes())
+
+#This function returns the node trace of the first frame; the frames only change the marker colours
+def nodeTrace(G,positions,states):
+    coords=positionArray(G,positions)
+    return {'x':coords[:,0], 'y':coords[:,1],
+            'mode':'markers',
+            'hoverinfo':'text',
+            'marker':{
+                    'size':15,
+                    'color':states,
+                    'colorscale':STATE_COLORSCALE,
+                    'cmin':0,
+                    'cmax':2,
+                    'line_width':3}}
+
+#This function returns the times of the frames that are shown: every `every`-th one, and always the last one
+def frameTimes(nb_frames,every=1):
+    times=list(range(0,nb_frames,every))
+    if times[-1]!=nb_frames-1:
+        times.append(nb_frames-1)
+    return times
+
+#This function returns the title of the frame at time t
+def frameTitle(data,t):
+    #change this if you want to change the information visualized at the top of the page 
+    return '<br>S (blue): '+str(data[t][0])+' I (red):'+str(data[t][1])+' R (green): '+str(data[t][2])
+
 #This function output an HTML file which allows to visualize the given SIRS model. 
 #INPUT: 
 #-G: whose noes have SIRS attributes, i.e., each node has attribute 'state' which consists of a 
@@ -19,65 +235,27 @@ import numpy as np
 #nb_framea: length of the simulation.
 #data: a list L of length nb_frames such that L[t] is a list [NS,NI,NR] representing the number of nodes in stat S, state I,
 # and state R, at time t.
-def showSIRS(G,filename,beta,gamma,xi,nb_frames,data):
+#every: only show every every-th frame (and the last one), for long simulations.
+#positions: the positions of the nodes, by default computed by nodePositions(G).
+#states: the states as an (nb_frames, nodes) array, instead of the 'state' attributes of the nodes.
+#auto_open: open the file in the browser; set it to False in batch jobs to only write the file.
+def showSIRS(G,filename,beta,gamma,xi,nb_frames,data,every=1,positions=None,states=None,auto_open=True):
     #nodes potitions
-    positions=nx.spring_layout(G, iterations=600)# iterations may slow the algorithm quite a bit
-    print("Nodes positions computed.")
+    if positions is None:
+        positions=nodePositions(G)
     
-    #start initialising the edge trace
-    edge_x = []
-    edge_y = []
-    for edge in G.edges():
-        x0, y0 = positions[edge[0]]
-        x1, y1 = positions[edge[1]]
-        edge_x.append(x0)
-        edge_x.append(x1)
-        edge_x.append(None)
-        edge_y.append(y0)
-        edge_y.append(y1)
-        edge_y.append(None)
-        
-    
-    edge_trace = go.Scatter(
-            x=edge_x, y=edge_y,
-            line=dict(width=1, color='#888'),
-                      hoverinfo='none',
-                      mode='lines')
-    print("Edges trace computed.")
+    #the edge trace is only part of the first frame; the other frames only update the node trace
+    edge_trace=edgeTrace(G,positions)
+    times=frameTimes(nb_frames,every)
 
-    #construction of the node trace
-    node_x,node_y=zip(*list(positions.values()))
-    node_trace=[]
-    #computation of the list of colour of each node col[n] will be the colour of the nth node in the current frame
-    for t in range(nb_frames):
-        col=[]
-        for n in G:
-            if G.nodes[n]['state'][t]==1:
-                col.append('red')
-            else:
-                if G.nodes[n]['state'][t]==0:
-                    col.append('blue')
-                else:
-                    col.append('green')
-        #set the attributes the nodes trace sizes, position, colours etc.
-        node_trace.append({
-                'x':node_x, 'y':node_y,
-                'mode':'markers',
-                'hoverinfo':'text',
-                'marker':{
-                        'size':15,
-                        'color':col,
-                        'line_width':3}})
-    print("Nodes trace computed.")
-    
-    #computing the list of frames to be visulaized
-    frames=[{'data':[edge_trace, node_trace[k]],
+    #computing the list of frames to be visulaized, each frame only holds the colour of every node 
+    frames=[{'data':[{'marker':{'color':nodeStates(G,t,states)}}],
+             'traces':[1],
                  'layout':{
-                    #change this if you want to change the information visualized at the top of the page 
-                    'title':'<br>S (blue): '+str(data[k][0])+' I (red):'+str(data[k][1])+' R (green): '+str(data[k][2]),
+                    'title':frameTitle(data,t),
                     'titlefont_size':16},
-    'name':str(k)} 
-    for k in range(nb_frames)]
+    'name':str(t)} 
+    for t in times]
     
     
     print("Frames computed.")
@@ -100,7 +278,7 @@ def showSIRS(G,filename,beta,gamma,xi,nb_frames,data):
                             "label": str(k),
                             "method": "animate",
                         }
-                        for k in range(nb_frames)
+                        for k in times
                     ],
                 }
             ]
@@ -153,7 +331,7 @@ def showSIRS(G,filename,beta,gamma,xi,nb_frames,data):
             'sliders':sliders
             }
 
-    fig = {'data':[edge_trace, node_trace[0]],
+    fig = {'data':[edge_trace, nodeTrace(G,positions,nodeStates(G,times[0],states))],
                  'layout':layout,
     'frames':frames}
     
@@ -161,18 +339,73 @@ def showSIRS(G,filename,beta,gamma,xi,nb_frames,data):
                 
     
     print("Visualization rendering done")
-    plotly.offline.plot(fig, filename=filename+"_graph.html", auto_open=True, validate=False)
+    plotly.offline.plot(fig, filename=filename+"_graph.html", auto_open=auto_open, validate=False)
     print("File saved.")
+    return positions
 
 
+#This function writes the frames of the given SIRS model to the directory `path` while they are computed,
+#instead of keeping all of them in one figure, so the size of the graph and the number of frames are only
+#limited by the disk. The input is the same as for showSIRS. It writes:
+#-path/graph.json: the node positions, the edges (once) and the times of the frames
+#-path/states_000000.npy, ...: the uint8 states of `chunk` frames each, shape (frames, nodes), in the order of the nodes of G
+#-path/frame_000000.png, ...: with images=True, one image per frame (this needs the kaleido package)
+def exportSIRS(G,path,beta,gamma,xi,nb_frames,data,every=1,chunk=100,images=False,positions=None,states=None):
+    os.makedirs(path, exist_ok=True)
+    if positions is None:
+        positions=nodePositions(G)
+    times=frameTimes(nb_frames,every)
+    coords=positionArray(G,positions)
+    with open(os.path.join(path,'graph.json'),'w') as f:
+        json.dump({'x':coords[:,0].tolist(), 'y':coords[:,1].tolist(),
+                   'edges':edgeArray(G).tolist(),
+                   'times':times,
+                   'data':[np.asarray(data[t]).tolist() for t in times],
+                   'chunk':chunk,
+                   'title':"SIRS model with beta="+str(beta)+" gamma="+str(gamma)+" xi="+str(xi)}, f)
+    
+    #for images, one figure is made and only the node colours are changed for every frame
+    if images:
+        fig=go.Figure(data=[edgeTrace(G,positions), nodeTrace(G,positions,nodeStates(G,times[0],states))])
+        fig.update_layout(showlegend=False,
+                          xaxis=dict(showgrid=False, zeroline=False, showticklabels=False),
+                          yaxis=dict(showgrid=False, zeroline=False, showticklabels=False))
+    
+    #only one chunk of frames is in memory at a time
+    buffer=np.empty((chunk,G.number_of_nodes()), dtype=np.uint8)
+    for k,t in enumerate(times):
+        buffer[k%chunk]=nodeStates(G,t,states)
+        if images:
+            fig.data[1].marker.color=buffer[k%chunk]
+            fig.update_layout(title=frameTitle(data,t))
+            fig.write_image(os.path.join(path,'frame_%06d.png' % k))
+        if k%chunk==chunk-1 or k==len(times)-1:
+            np.save(os.path.join(path,'states_%06d.npy' % (k//chunk)), buffer[:k%chunk+1])
+    print("Frames written to "+path)
+    return positions
+
 
-def showData(data,filename,beta,gamma,xi):
-    data=np.array(data)
-    t=list(range(len(data)))
+#This function outputs an HTML file with the S, I and R curves of a simulation and dots that move along them.
+#INPUT: 
+#-data: a list or array L of length nb_frames such that L[t] is [NS,NI,NR], as for showSIRS.
+#-filename: the name of the html file to be generated (filename_data.html).
+#-beta, gamma, xi: the parameters of the model, shown in the title.
+#-every: only make a frame for every every-th time (and the last one), for long simulations.
+#-frames: the number of frames to aim for instead of every, e.g. 200 for a run of any length.
+#-auto_open: open the file in the browser; set it to False in batch jobs to only write the file.
+#The curves are drawn once, the frames only move the three dots, so the file grows linearly with the run.
+def showData(data,filename,beta,gamma,xi,every=1,frames=None,auto_open=True):
+    data=np.asarray(data)
+    nb_frames=len(data)
+    if frames is not None:
+        every=max(1,-(-nb_frames//frames))
+    times=frameTimes(nb_frames,every)
+    t=list(range(nb_frames))
     #slice the coloumns of the given matrix (note that the input is just a matrix xXn)
-    y=data[:,0]
-    y1=data[:,1]
-    y2=data[:,2]
+    y=data[:,0].tolist()
+    y1=data[:,1].tolist()
+    y2=data[:,2].tolist()
+    title="SIRS model data with beta="+str(beta)+" gamma="+str(gamma)+" xi="+str(xi)
     
     sliders = [{
                     "pad": {"b": 10, "t": 60},
@@ -182,7 +415,7 @@ def showData(data,filename,beta,gamma,xi):
                     "steps": [
                         {
                             "args": [[str(k)], {
-                "frame": {"duration": 0},
+                "frame": {"duration": 0, "redraw": False},
                 "mode": "immediate",
                 "fromcurrent": True,
                 "transition": {"duration": 0, "easing": "linear"},
@@ -190,7 +423,7 @@ def showData(data,filename,beta,gamma,xi):
                             "label": str(k),
                             "method": "animate",
                         }
-                        for k in range(len(t))
+                        for k in times
                     ],
                 }
             ]
@@ -214,24 +447,27 @@ def showData(data,filename,beta,gamma,xi):
                          'line':dict(width=2, color="green")},
                #traces for the moving dots
                {
-                'x':[0],
-                'y':[data[0][0]],
+                'x':[times[0]],
+                'y':[y[times[0]]],
                 'mode':"markers",
+                'name':"Susceptible at t",
                 'marker':dict(color="blue", size=10)}, 
                {
-                'x':[0],
-                'y':[data[0][1]],
+                'x':[times[0]],
+                'y':[y1[times[0]]],
                 'mode':"markers",
+                'name':"Infected at t",
                 'marker':dict(color="red", size=10)},
                {
-                'x':[0],
-                'y':[data[0][2]],
+                'x':[times[0]],
+                'y':[y2[times[0]]],
                 'mode':"markers",
+                'name':"Recovered at t",
                 'marker':dict(color="green", size=10)}],
         'layout':{
-            'xaxis':dict(range=[0, len(t)], autorange=False, zeroline=False),
+            'xaxis':dict(range=[0, nb_frames], autorange=False, zeroline=False),
             'yaxis':dict(range=[-1, max(y)+10], autorange=False, zeroline=False),
-            'title_text':"SIRS model data with beta="+str(beta)+" gamma="+str(gamma)+" xi="+str(xi),
+            'title_text':title,
             'hovermode':"closest",
             'updatemenus': [
                 {
@@ -259,43 +495,11 @@ def showData(data,filename,beta,gamma,xi):
                 }
              ],
             'sliders':sliders},
-        #initialization of the frame list
+        #the frames only move the dots (traces 3, 4 and 5); the lines stay as they are
         'frames':[{
-            'data':[{'x':t, 'y':y,
-                         'mode':"lines",
-                         'name':"Susceptible",
-                         'line':{'width':2, 'color':"blue"}},
-                {'x':t, 'y':y1,
-                         'mode':"lines",
-                         'name':"Infected",
-                         'line':{'width':2, 'color':"red"}},
-                {'x':t, 'y':y2,
-                         'name':"Recovered",
-                         'mode':"lines",
-                         'line':{'width':2, 'color':"green"}},
-                {
-                'x':[k],
-                'y':[data[k][0]],
-                'mode':"markers",
-                'name':"Susceptible at t",
-                'marker':{'color':"blue", 'size':10}}, 
-                {'x':[k],
-                'y':[data[k][1]],
-                'mode':"markers",
-                'name':"Infected at t",
-                'marker':{'color':"red", 'size':10}},
-                {'x':[k],
-                'y':[data[k][2]],
-                'mode':"markers",
-                'name':"Recovered at t",
-                'marker':{'color':"green", 'size':10}}
-                ],
-            'layout':{
-                    'title':"SIRS model data with beta="+str(beta)+" gamma="+str(gamma)+" xi="+str(xi),
-                    'titlefont_size':16},
-            'name':str(k)}          
-            for k in range(len(t))],
+            'data':[{'x':[k], 'y':[s]}, {'x':[k], 'y':[i]}, {'x':[k], 'y':[r]}],
+            'traces':[3,4,5],
+            'name':str(k)}
+            for k,(s,i,r) in zip(times,data[times,:3].tolist())],
     }
-    plotly.offline.plot(fig, filename=filename+"_data.html", auto_open=True, validate=False)
-
-
+    return plotly.offline.plot(fig, filename=filename+"_data.html", auto_open=auto_open, validate=False)